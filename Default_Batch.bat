@@ -0,0 +1 @@
+python a2lbatch.py Default_Batch.csv
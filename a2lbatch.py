@@ -0,0 +1,133 @@
+import csv
+import io
+import os
+import runpy
+import sys
+import time
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from os import path
+
+
+# CLI arguments: a2lbatch.py [manifest_csv] [workers?]
+#
+# The manifest is a CSV with one conversion job per row:
+#
+#   Script,A2L,CSV,ECU,Offset
+#   a2l2xdf.py,SC8F90.a2l,V1.0.csv,,200000
+#   a2l2xml.py,SC8F90.a2l,V1.0.csv,Simos18,200000
+#
+# ECU is only used by a2l2xml.py. Jobs that share an A2L run one after the other
+# in the same worker, so the A2L is only imported into its db once; different A2Ls
+# are converted in parallel.
+
+SCRIPT_DIR = path.dirname(path.abspath(__file__))
+
+
+def job_argv(job):
+    argv = [job["Script"], job["A2L"], job["CSV"]]
+    if job["Script"] == "a2l2xml.py":
+        argv.append(job["ECU"])
+    argv.append(job["Offset"])
+    return argv
+
+
+def job_name(job):
+    return f'{job["Script"]} {job["A2L"]} {job["CSV"]}'
+
+
+def job_log_path(job):
+    # Jobs of one A2L and script differ by CSV (and ECU), and may run at the same time
+    parts = [job["A2L"], path.splitext(job["Script"])[0], path.splitext(path.basename(job["CSV"]))[0]]
+    if job["Script"] == "a2l2xml.py":
+        parts.append(job["ECU"])
+    return ".".join(parts) + ".log"
+
+
+def run_job(job):
+    # Modules imported by a job (pya2l included) stay loaded for the next job in the same worker,
+    # CSVs too: load_csv_rows() caches them per process, a missing one only fails its own job
+    script = path.join(SCRIPT_DIR, job["Script"])
+    log = io.StringIO()
+    start = time.perf_counter()
+    error = None
+    saved_argv = sys.argv
+    sys.argv = job_argv(job)
+    try:
+        with redirect_stdout(log):
+            runpy.run_path(script, run_name="__main__")
+    except SystemExit as exit:
+        # Scripts may sys.exit() when they are done, only a non-zero code is a failure
+        if exit.code not in (None, 0):
+            error = traceback.format_exc()
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        sys.argv = saved_argv
+    elapsed = time.perf_counter() - start
+
+    log_path = job_log_path(job)
+    with open(log_path, "w", encoding="utf-8") as logfile:
+        logfile.write(log.getvalue())
+        if error:
+            logfile.write(error)
+    return {"job": job_name(job), "seconds": elapsed, "error": error, "log": log_path}
+
+
+def run_jobs(jobs):
+    return [run_job(job) for job in jobs]
+
+
+def load_manifest(manifest_path):
+    with open(manifest_path, encoding="utf-8-sig") as manifest:
+        jobs = []
+        for row in csv.DictReader(manifest):
+            if row["Script"] is None or len(row["Script"].strip()) == 0:
+                continue
+            jobs.append({key: (value or "").strip() for key, value in row.items()})
+    return jobs
+
+
+def group_by_a2l(jobs):
+    groups = {}
+    for job in jobs:
+        groups.setdefault(path.abspath(job["A2L"]), []).append(job)
+    return list(groups.values())
+
+
+def main():
+    jobs = load_manifest(sys.argv[1])
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    groups = group_by_a2l(jobs)
+    workers = max(1, min(workers, len(groups)))
+    print(f"Running {len(jobs)} jobs for {len(groups)} A2Ls on {workers} workers")
+
+    start = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_jobs, group): group for group in groups}
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+            except Exception:
+                # The worker itself died (e.g. killed or out of memory)
+                results = [
+                    {"job": job_name(job), "seconds": 0.0, "error": traceback.format_exc(), "log": ""}
+                    for job in futures[future]
+                ]
+            for result in results:
+                if result["error"]:
+                    failed += 1
+                    print(f'FAILED {result["job"]} ({result["seconds"]:.1f}s), see {result["log"]}')
+                else:
+                    print(f'OK     {result["job"]} ({result["seconds"]:.1f}s)')
+
+    print(f"Finished {len(jobs)} jobs in {time.perf_counter() - start:.1f}s, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
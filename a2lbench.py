@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from contextlib import contextmanager, redirect_stdout
+from os import path
+
+from a2lcache import close_a2l, open_a2l, pya2l_version
+from a2lcommon import load_csv_rows
+from a2lconvert import convert, emitter_for_format
+from a2lsynth import generate_a2l, generate_csv
+from tabledefs import load_table_defs
+
+# Benchmarks the converters on synthetic A2Ls (see a2lsynth.py), fully offline.
+#
+#   python3 a2lbench.py --sizes 100,1000,10000 --output bench.json
+#   python3 a2lbench.py --sizes 100,1000,10000 --compare bench.json
+#
+# For every size it times, in a private A2L cache:
+#
+#   generate          writing the synthetic A2L and CSV
+#   import            importing the A2L into a db (pya2l)
+#   resolve.csv       resolving the CSV tables into a fresh table snapshot
+#   resolve.warm      loading the same tables again from the snapshot
+#   resolve.all       resolving the FUNCTION and GROUP membership lists (--all)
+#   <format>.build    building the table elements of each output format
+#   <format>.serialize  serializing and writing them out
+#   <format>.rerun    the same conversion again, reusing the previous output's fragments
+#
+# Results are written as JSON. With --compare, stages slower than --threshold times the
+# baseline are reported as regressions and the exit code is 1.
+
+FORMATS = ["xdf", "dsg", "xml-Simos18", "xml-DQ250"]
+
+# Stages shorter than this in the baseline are too noisy to flag
+MIN_COMPARE_SECONDS = 0.05
+
+
+class TimedEmitter:
+    """Wraps an emitter, splitting its time into building elements and serializing them."""
+
+    def __init__(self, emitter):
+        self.emitter = emitter
+        self.filename = emitter.filename
+        self.membership = emitter.membership
+        self.build_seconds = 0.0
+        self.serialize_seconds = 0.0
+
+    def open(self, segments):
+        self.emitter.open(segments)
+        writer = self.emitter.xml_writer
+        serialize = self.emitter.serialize
+        write_fragment = writer.write_fragment
+
+        def timed_serialize(root):
+            start = time.perf_counter()
+            fragment = serialize(root)
+            self.serialize_seconds += time.perf_counter() - start
+            return fragment
+
+        def timed_write_fragment(fragment):
+            start = time.perf_counter()
+            write_fragment(fragment)
+            self.serialize_seconds += time.perf_counter() - start
+
+        self.emitter.serialize = timed_serialize
+        writer.write_fragment = timed_write_fragment
+
+    def build_table(self, c_data, category, sub_category, subsub_category, custom_name):
+        start = time.perf_counter()
+        serialized = self.serialize_seconds
+        self.emitter.build_table(c_data, category, sub_category, subsub_category, custom_name)
+        # Serializing within build_table has already been counted
+        self.build_seconds += time.perf_counter() - start - (self.serialize_seconds - serialized)
+
+    def close(self):
+        start = time.perf_counter()
+        self.emitter.close()
+        self.serialize_seconds += time.perf_counter() - start
+
+    def abort(self):
+        self.emitter.abort()
+
+
+@contextmanager
+def quiet():
+    # The converters print a line per table, which would dominate large runs on a console
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        yield
+
+
+def timed(stages, stage, function, *args, **kwargs):
+    start = time.perf_counter()
+    with quiet():
+        result = function(*args, **kwargs)
+    stages[stage] = time.perf_counter() - start
+    return result
+
+
+def run_size(size, args):
+    stages = {}
+    # Relative paths, like the converters are run from the .bat files: output names are built from them
+    a2l_path = f"SYNTH{size}.a2l"
+    csv_path = f"SYNTH{size}.csv"
+
+    def generate():
+        names = generate_a2l(
+            a2l_path,
+            size,
+            std_axis_ratio=args.std_axis_ratio,
+            axis_pts=args.axis_pts,
+            compu_method_count=args.compu_methods,
+            functions=args.functions,
+            groups=args.groups,
+            seed=args.seed,
+        )
+        generate_csv(csv_path, names, max(1, int(size * args.csv_ratio)), seed=args.seed)
+
+    timed(stages, "generate", generate)
+    # The session is closed right away, the db stays locked for the stages after it otherwise
+    timed(stages, "import", lambda: close_a2l(open_a2l(a2l_path)))
+
+    names = [row["Table Name"] for row in load_csv_rows(csv_path)]
+    timed(stages, "resolve.csv", load_table_defs, a2l_path, names)
+    timed(stages, "resolve.warm", load_table_defs, a2l_path, names)
+    selections = [csv_path]
+    if args.all:
+        timed(stages, "resolve.all", load_table_defs, a2l_path, memberships=["Function", "Group"])
+        selections.append("ALL")
+
+    for output_format in args.formats:
+        for selection in selections:
+            prefix = output_format if selection != "ALL" else f"{output_format}.all"
+            emitter = TimedEmitter(emitter_for_format(output_format, a2l_path, selection, "0"))
+            with quiet():
+                convert(a2l_path, selection, [emitter])
+            stages[f"{prefix}.build"] = emitter.build_seconds
+            stages[f"{prefix}.serialize"] = emitter.serialize_seconds
+            emitter = emitter_for_format(output_format, a2l_path, selection, "0")
+            timed(stages, f"{prefix}.rerun", convert, a2l_path, selection, [emitter])
+            if not args.keep:
+                os.remove(emitter.filename)
+    return stages
+
+
+def compare(results, baseline, threshold):
+    """Print new/baseline ratios for every stage both runs have, returns the number of regressions."""
+    regressions = 0
+    for size, stages in results["results"].items():
+        baseline_stages = baseline.get("results", {}).get(size)
+        if baseline_stages is None:
+            continue
+        for stage, seconds in stages.items():
+            if stage not in baseline_stages:
+                continue
+            ratio = seconds / baseline_stages[stage] if baseline_stages[stage] > 0 else float("inf")
+            flag = ""
+            if baseline_stages[stage] >= MIN_COMPARE_SECONDS and ratio > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{size:>8} {stage:<28} {baseline_stages[stage]:9.3f}s -> {seconds:9.3f}s  x{ratio:5.2f}{flag}")
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the A2L converters on synthetic A2Ls")
+    parser.add_argument("--sizes", default="100,1000,10000", help="comma separated CHARACTERISTIC counts")
+    parser.add_argument("--formats", default=",".join(FORMATS), help="comma separated a2lconvert.py formats")
+    parser.add_argument("--std-axis-ratio", type=float, default=0.25, help="share of STD_AXIS curves and maps")
+    parser.add_argument("--axis-pts", type=int, default=100, help="number of shared AXIS_PTS")
+    parser.add_argument("--compu-methods", type=int, default=50, help="number of COMPU_METHODs")
+    parser.add_argument("--functions", type=int, default=50, help="number of FUNCTIONs")
+    parser.add_argument("--groups", type=int, default=50, help="number of GROUPs")
+    parser.add_argument("--csv-ratio", type=float, default=0.5, help="share of the characteristics in the CSV")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--all", action="store_true", help="also time ALL mode")
+    parser.add_argument("--output", default="a2lbench.json", help="where to write the results")
+    parser.add_argument("--compare", help="baseline results to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio reported as a regression")
+    parser.add_argument("--keep", help="directory to generate into and keep, instead of a temporary one")
+    args = parser.parse_args(argv)
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+    args.formats = args.formats.split(",")
+    return args
+
+
+def main(argv):
+    args = parse_args(argv)
+    if args.keep:
+        os.makedirs(args.keep, exist_ok=True)
+        work = None
+        work_dir = args.keep
+    else:
+        work = tempfile.TemporaryDirectory(prefix="a2lbench-")
+        work_dir = work.name
+    # Every run imports into its own cache, so imports are always cold
+    os.environ["A2L_CACHE_DIR"] = path.join(work_dir, "cache")
+    output_path = path.abspath(args.output)
+    compare_path = path.abspath(args.compare) if args.compare else None
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pya2l": pya2l_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "keep")},
+        "results": {},
+    }
+    try:
+        for size in args.sizes:
+            stages = run_size(size, args)
+            results["results"][str(size)] = stages
+            print(f"{size} characteristics")
+            for stage, seconds in stages.items():
+                print(f"  {stage:<28} {seconds:9.3f}s")
+    finally:
+        os.chdir(cwd)
+        if work is not None:
+            work.cleanup()
+
+    with open(output_path, "w", encoding="utf-8") as output:
+        json.dump(results, output, indent=2)
+    print("Results written to", output_path)
+
+    if compare_path:
+        with open(compare_path, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.threshold)
+        print(f"{regressions} regressions (threshold x{args.threshold})")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
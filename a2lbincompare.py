@@ -1,75 +1,421 @@
-from pya2l import DB, model
-from pya2l.api import inspect
-from sys import argv
-
-db = DB()
-db2 = DB()
-# session = db.import_a2l(argv[1])
-
-# CLI arguments: a2lbincompare.py [first_a2l] [first_bin] [second_a2l] [second_bin] [search_term?]
-
-# First A2L & bin
-session = db.open_existing(argv[1])
-data1 = open(argv[2], "rb").read()
-
-# Second A2L & bin
-session2 = db2.open_existing(argv[3])
-data2 = open(argv[4], "rb").read()
-
-search_term = (
-    argv[5] if len(argv) > 5 else None
-)
-
-def calc_map_size(characteristic):
-    data_sizes = {
-        "UWORD": 2,
-        "UBYTE": 1,
-        "SBYTE": 1,
-        "SWORD": 2,
-        "ULONG": 4,
-        "SLONG": 4,
-        "FLOAT32_IEEE": 4,
-    }
-    data_size = data_sizes[characteristic.deposit.fncValues["datatype"]]
-    map_size = data_size
-    for axis_ref in characteristic.axisDescriptions:
-        map_size *= axis_ref.maxAxisPoints
-    return map_size
-
-
-characteristics = (
-    session.query(model.Characteristic).order_by(model.Characteristic.name).all()
-)
-
-for c in characteristics:
-    if search_term and (search_term not in (c.name+c.longIdentifier)):
-        # Characteristic does not meet search term, continue
-        continue
-
-    # Get characteristic from both A2Ls, using the name from the first one
-    characteristic_data = inspect.Characteristic(session, c.name)
-    try:
-        characteristic_data2 = inspect.Characteristic(session2, c.name)
-    except:
-        continue
-        # print(c.name + " does not exist in: "+argv[3])
+import csv
+import hashlib
+import mmap
+import os
+import sys
+import time
+
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from os import path
+
+from a2lcommon import calc_map_size, take_options
+from tabledefs import load_table_defs
+
+# CLI arguments: a2lbincompare.py [first_a2l] [first_bin] [second_a2l] [second_bin] [search_term?] [--base address]
+#                [--cells] [--grids grids.npz] [--byte-order MSB_FIRST]
+#
+# Joins the characteristics of both A2Ls by name, lists those only in one of them and those
+# whose address or size changed, then prints the characteristics whose data differs between
+# the two bins. With --cells the values of the differing maps are decoded (see a2lvalues.py,
+# needs NumPy) and the number of changed cells and the largest absolute and relative change
+# are printed for each; --grids also writes the before and after values to an .npz.
+#
+# The offset and size of every map are worked out up front from the table snapshots (see
+# tabledefs.py). A bin starts at the MEMORY_SEGMENT most characteristics of its A2L are in,
+# unless --base gives its address. Both bins are memory mapped and compared a block at a
+# time, and only the maps in blocks that differ are read and compared on their own.
+#
+# Fleet mode compares many bins against a stock bin of the same A2L:
+#
+#   a2lbincompare.py --fleet [a2l] [stock_bin] [bin or directory...] [--output fleet.csv]
+#                    [--workers N] [--hashes] [--search term] [--base address]
+#
+# The map layout is resolved once and the bins (every .bin of a directory) are compared on a
+# process pool. fleet.csv has a row per map that differs in any bin and a column per bin,
+# marked X where the bin differs from stock. With --hashes each map's content is hashed too:
+# the cells number the distinct versions of the map instead, and bins with identical
+# calibrations are grouped.
+
+# Bytes per block when looking for the parts of two bins that differ
+BLOCK_SIZE = 4096
+
+
+def characteristic_names(snapshot, search_term=None):
+    """Every characteristic of the A2L in name order, only those matching search_term if given."""
+    names = [name for name, _ in snapshot.memberships["Characteristic"]]
+    if not search_term:
+        return names
+    return [name for name in names if search_term in name + snapshot.get(name).long_identifier]
+
+
+def map_start(table):
+    """STD_AXIS maps start at their first axis, so the axis points in front of the values are compared too."""
+    if len(table.axes) > 0 and table.axes[0] is not None and table.axes[0].kind == "STD_AXIS":
+        return table.axes[0].address
+    return table.address
+
+
+def map_size(table):
+    return table.address + calc_map_size(table) - map_start(table)
+
+
+def bin_base_address(snapshot, tables):
+    """Start of the MEMORY_SEGMENT most of the tables are in, which is where a bin of the A2L starts."""
+    starts = sorted(set(snapshot.segments.values()))
+    counts = {}
+    for table in tables:
+        position = bisect_right(starts, table.address) - 1
+        if position >= 0:
+            counts[starts[position]] = counts.get(starts[position], 0) + 1
+    if len(tables) > 0 and len(counts) == 0:
+        raise ValueError("No MEMORY_SEGMENT holds the characteristics, give the bin's address with --base")
+    return max(counts, key=counts.get, default=0)
+
+
+def a2l_base_address(snapshot):
+    """bin_base_address() of all the characteristics, so every tool and search places a bin the same way."""
+    return bin_base_address(snapshot, [snapshot.get(name) for name in characteristic_names(snapshot)])
+
 
-    # Get the map size (should be the same but best to double check)
-    map_size = calc_map_size(characteristic_data)
-    map_size2 = calc_map_size(characteristic_data2)
+def map_layout(tables, base_address):
+    """Offset in the bin and size of each map, as arrays in the order of tables."""
+    offsets = array("q")
+    sizes = array("q")
+    for table in tables:
+        offsets.append(map_start(table) - base_address)
+        sizes.append(map_size(table))
+    return offsets, sizes
 
-    # Get offset
-    offset = characteristic_data.address - 0xA0800000
-    offset2 = characteristic_data2.address - 0xA0800000
 
-    # Get data from bin
-    data1_map = data1[offset : offset + map_size]
-    data2_map = data2[offset2 : offset2 + map_size2]
+def join_characteristics(snapshot1, names1, snapshot2, names2):
+    """
+    Join two A2Ls' characteristics by name. Returns the names in both (in the order of names1),
+    the names only in the first and only in the second, and the (name, first, second) address
+    and map size pairs of the common names whose address or size changed.
+    """
+    tables2 = {name: snapshot2.get(name) for name in names2}
+    common = []
+    removed = []
+    moved = []
+    resized = []
+    for name in names1:
+        table2 = tables2.get(name)
+        if table2 is None:
+            removed.append(name)
+            continue
+        common.append(name)
+        table1 = snapshot1.get(name)
+        if map_start(table1) != map_start(table2):
+            moved.append((name, map_start(table1), map_start(table2)))
+        if map_size(table1) != map_size(table2):
+            resized.append((name, map_size(table1), map_size(table2)))
+    in_first = set(names1)
+    added = [name for name in names2 if name not in in_first]
+    return common, removed, added, moved, resized
 
-    # Check match
-    is_match = data1_map == data2_map
 
-    if not is_match:
+def print_join(first_a2l, second_a2l, removed, added, moved, resized):
+    print(f"Only in {first_a2l}: {len(removed)}")
+    for name in removed:
+        print("  " + name)
+    print(f"Only in {second_a2l}: {len(added)}")
+    for name in added:
+        print("  " + name)
+    print(f"Moved: {len(moved)}")
+    for name, address1, address2 in moved:
+        print(f"  {name} {hex(address1)} -> {hex(address2)}")
+    print(f"Resized: {len(resized)}")
+    for name, size1, size2 in resized:
+        print(f"  {name} {size1} -> {size2} bytes")
+    print("Differing data:")
+
+
+def print_cell_diff(names, tables1, data1, base_address1, tables2, data2, base_address2, byte_order, grids_path):
+    # Imported here so comparing without decoding does not need NumPy
+    import numpy as np
+
+    from a2lvalues import DEFAULT_BYTE_ORDER, diff_cells, save_grids
+
+    def values_in_bin(table, data, base_address):
+        offset = table.address - base_address
+        return offset >= 0 and offset + calc_map_size(table) <= len(data)
+
+    decodable = []
+    for index, name in enumerate(names):
+        table1 = tables1[index]
+        table2 = tables2[index]
+        if table1.dimensions != table2.dimensions:
+            print(f"{name} : {table1.long_identifier}  (dimensions changed, not decoded)")
+        elif not values_in_bin(table1, data1, base_address1) or not values_in_bin(table2, data2, base_address2):
+            print(f"{name} : {table1.long_identifier}  (outside the bin, not decoded)")
+        else:
+            decodable.append(index)
+
+    names = [names[index] for index in decodable]
+    tables1 = [tables1[index] for index in decodable]
+    tables2 = [tables2[index] for index in decodable]
+    diff = diff_cells(
+        data1,
+        tables1,
+        np.array([table.address - base_address1 for table in tables1], dtype=np.int64),
+        data2,
+        tables2,
+        np.array([table.address - base_address2 for table in tables2], dtype=np.int64),
+        (byte_order or DEFAULT_BYTE_ORDER).upper(),
+    )
+    for index, name in enumerate(names):
+        if diff.changed[index] == 0:
+            # STD_AXIS maps are compared with their axis points
+            print(f"{name} : {tables1[index].long_identifier}  values unchanged, axis points differ")
+            continue
         print(
-            characteristic_data.name + " : " + characteristic_data.longIdentifier
-        )  #  " @ " + hex(offset) + ":" + hex(offset+map_size) +
+            f"{name} : {tables1[index].long_identifier}  {diff.changed[index]} of {diff.counts[index]} cells, "
+            f"max delta {diff.max_delta[index]:g}, max {diff.max_relative[index] * 100:.1f}%"
+        )
+    if grids_path:
+        save_grids(grids_path, names, diff)
+        print("Before / after values written to", grids_path)
+
+
+def base_option(options):
+    return int(options["--base"], 16) if options.get("--base") else None
+
+
+def open_bin(bin_path):
+    with open(bin_path, "rb") as bin_file:
+        return mmap.mmap(bin_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def differing_blocks(data1, data2):
+    """Start offsets of the BLOCK_SIZE blocks that differ between two bins."""
+    for start in range(0, max(len(data1), len(data2)), BLOCK_SIZE):
+        if data1[start : start + BLOCK_SIZE] != data2[start : start + BLOCK_SIZE]:
+            yield start
+
+
+class MapPairs:
+    """
+    The maps to compare and where they are in each bin. Maps at the same offset and size in
+    both bins are indexed by offset, so the bins are compared block by block and only the
+    maps overlapping a differing block are compared byte for byte. Maps that moved are
+    always compared. Maps that are not wholly inside both bins are never compared.
+    """
+
+    def __init__(self, layout1, layout2):
+        self.offsets1, self.sizes1 = layout1
+        self.offsets2, self.sizes2 = layout2
+        fixed = []
+        self.moved = []
+        for index, (offset1, size1, offset2, size2) in enumerate(
+            zip(self.offsets1, self.sizes1, self.offsets2, self.sizes2)
+        ):
+            if offset1 == offset2 and size1 == size2 and offset1 >= 0:
+                fixed.append((offset1, index))
+            else:
+                self.moved.append(index)
+        fixed.sort()
+        self.fixed_offsets = array("q", [offset for offset, _ in fixed])
+        self.fixed_indices = array("q", [index for _, index in fixed])
+        self.max_size = max((self.sizes1[index] for index in self.fixed_indices), default=0)
+        # (size of bin 1, size of bin 2) -> indices of the maps outside either bin
+        self.outside_by_sizes = {}
+
+    def outside(self, size1, size2):
+        """Indices of the maps that start before or end after a bin of size1 / size2 bytes."""
+        if (size1, size2) not in self.outside_by_sizes:
+            self.outside_by_sizes[size1, size2] = [
+                index
+                for index, (offset1, size_of_map1, offset2, size_of_map2) in enumerate(
+                    zip(self.offsets1, self.sizes1, self.offsets2, self.sizes2)
+                )
+                if offset1 < 0 or offset1 + size_of_map1 > size1 or offset2 < 0 or offset2 + size_of_map2 > size2
+            ]
+        return self.outside_by_sizes[size1, size2]
+
+    def candidates(self, data1, data2):
+        candidates = set(self.moved)
+        for block_start in differing_blocks(data1, data2):
+            # Maps starting up to max_size before the block may reach into it
+            low = bisect_left(self.fixed_offsets, block_start - self.max_size + 1)
+            high = bisect_left(self.fixed_offsets, block_start + BLOCK_SIZE)
+            for position in range(low, high):
+                index = self.fixed_indices[position]
+                if self.offsets1[index] + self.sizes1[index] > block_start:
+                    candidates.add(index)
+        return sorted(candidates)
+
+    def differing(self, data1, data2):
+        """Indices of the maps whose bytes differ between the two bins, leaving out those outside them."""
+        outside = set(self.outside(len(data1), len(data2)))
+        return [
+            index
+            for index in self.candidates(data1, data2)
+            if index not in outside
+            and data1[self.offsets1[index] : self.offsets1[index] + self.sizes1[index]]
+            != data2[self.offsets2[index] : self.offsets2[index] + self.sizes2[index]]
+        ]
+
+
+# Fleet workers compare against the same layout and stock bin, set up once per process
+fleet_pairs = None
+fleet_stock = None
+
+
+def init_fleet_worker(pairs, stock_path):
+    global fleet_pairs, fleet_stock
+    fleet_pairs = pairs
+    fleet_stock = open_bin(stock_path)
+
+
+def map_digest(data, offset, size):
+    return hashlib.sha256(data[offset : offset + size]).digest()
+
+
+def compare_to_stock(hashes, bin_path):
+    """The maps of a bin that differ from the stock bin, and their digests with hashes."""
+    data = open_bin(bin_path)
+    try:
+        differing = fleet_pairs.differing(fleet_stock, data)
+        digests = None
+        if hashes:
+            digests = [map_digest(data, fleet_pairs.offsets2[index], fleet_pairs.sizes2[index]) for index in differing]
+    finally:
+        data.close()
+    return differing, digests
+
+
+def fleet_bin_paths(paths):
+    bin_paths = []
+    for bin_path in paths:
+        if path.isdir(bin_path):
+            bin_paths += sorted(
+                path.join(bin_path, name) for name in os.listdir(bin_path) if name.lower().endswith(".bin")
+            )
+        else:
+            bin_paths.append(bin_path)
+    return bin_paths
+
+
+def write_fleet_matrix(output_path, snapshot, names, bin_paths, results):
+    """Write the map x bin matrix, numbering the versions of each map when there are digests."""
+    differing = sorted(set(index for indices, _ in results for index in indices))
+    cells = {index: [""] * len(bin_paths) for index in differing}
+    for column, (indices, digests) in enumerate(results):
+        for position, index in enumerate(indices):
+            cells[index][column] = "X" if digests is None else digests[position]
+    with open(output_path, "w", newline="", encoding="utf-8") as output:
+        writer = csv.writer(output)
+        writer.writerow(["Characteristic", "Long Identifier"] + bin_paths)
+        for index in differing:
+            versions = {}
+            row = [
+                cell if cell in ("", "X") else str(versions.setdefault(cell, len(versions) + 1))
+                for cell in cells[index]
+            ]
+            writer.writerow([names[index], snapshot.get(names[index]).long_identifier] + row)
+    return len(differing)
+
+
+def fleet(a2l_path, stock_path, bin_paths, output_path, workers, hashes=False, search_term=None, base_address=None):
+    snapshot = load_table_defs(a2l_path, memberships=["Characteristic"])
+    names = characteristic_names(snapshot, search_term)
+    tables = [snapshot.get(name) for name in names]
+    if base_address is None:
+        base_address = a2l_base_address(snapshot)
+    layout = map_layout(tables, base_address)
+    pairs = MapPairs(layout, layout)
+
+    start = time.perf_counter()
+    workers = max(1, min(workers, len(bin_paths)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_fleet_worker, initargs=(pairs, stock_path)) as executor:
+        results = list(executor.map(partial(compare_to_stock, hashes), bin_paths))
+    differing = write_fleet_matrix(output_path, snapshot, names, bin_paths, results)
+
+    stock_size = path.getsize(stock_path)
+    for bin_path, (indices, _) in zip(bin_paths, results):
+        outside = pairs.outside(stock_size, path.getsize(bin_path))
+        if len(outside) > 0:
+            print(f"{bin_path}: {len(outside)} maps outside the bin, not compared")
+        print(f"{len(indices):>8} maps differ  {bin_path}")
+    print(f"Compared {len(bin_paths)} bins on {workers} workers in {time.perf_counter() - start:.1f}s, "
+          f"{differing} of {len(names)} maps differ somewhere, see {output_path}")
+
+    if hashes:
+        calibrations = {}
+        for bin_path, (indices, digests) in zip(bin_paths, results):
+            calibrations.setdefault(tuple(zip(indices, digests)), []).append(bin_path)
+        print(f"{len(calibrations)} distinct calibrations:")
+        for calibration, group in sorted(calibrations.items(), key=lambda item: -len(item[1])):
+            label = "stock" if len(calibration) == 0 else f"{len(calibration)} maps changed"
+            print(f"  {len(group):>6} bins, {label}: {', '.join(group)}")
+
+
+def fleet_main(argv):
+    argv, options = take_options(
+        argv, ("--output", "--search", "--base"), flags=("--hashes",), counts=("--workers",)
+    )
+    workers = int(options["--workers"]) if options.get("--workers") else os.cpu_count()
+    fleet(
+        argv[0],
+        argv[1],
+        fleet_bin_paths(argv[2:]),
+        options.get("--output") or "fleet.csv",
+        workers,
+        "--hashes" in options,
+        options.get("--search") or None,
+        base_option(options),
+    )
+
+
+def main(argv):
+    if argv[1] == "--fleet":
+        fleet_main(argv[2:])
+        return
+    argv, options = take_options(argv, ("--base", "--grids", "--byte-order"), flags=("--cells",))
+    search_term = argv[5] if len(argv) > 5 else None
+
+    snapshot1 = load_table_defs(argv[1], memberships=["Characteristic"])
+    snapshot2 = load_table_defs(argv[3], memberships=["Characteristic"])
+    names, removed, added, moved, resized = join_characteristics(
+        snapshot1,
+        characteristic_names(snapshot1, search_term),
+        snapshot2,
+        characteristic_names(snapshot2, search_term),
+    )
+    print_join(argv[1], argv[3], removed, added, moved, resized)
+
+    tables1 = [snapshot1.get(name) for name in names]
+    tables2 = [snapshot2.get(name) for name in names]
+    base_address1 = base_address2 = base_option(options)
+    if base_address1 is None:
+        base_address1 = a2l_base_address(snapshot1)
+        base_address2 = a2l_base_address(snapshot2)
+
+    data1 = open_bin(argv[2])
+    data2 = open_bin(argv[4])
+    pairs = MapPairs(map_layout(tables1, base_address1), map_layout(tables2, base_address2))
+    for index in pairs.outside(len(data1), len(data2)):
+        print(f"{names[index]} : {tables1[index].long_identifier}  (outside the bin, not compared)")
+    differing = pairs.differing(data1, data2)
+    if "--cells" in options or options.get("--grids"):
+        print_cell_diff(
+            [names[index] for index in differing],
+            [tables1[index] for index in differing],
+            data1,
+            base_address1,
+            [tables2[index] for index in differing],
+            data2,
+            base_address2,
+            options.get("--byte-order"),
+            options.get("--grids"),
+        )
+        return
+    for index in differing:
+        print(tables1[index].name + " : " + tables1[index].long_identifier)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
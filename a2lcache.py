@@ -0,0 +1,135 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from importlib import metadata
+
+from a2lprofile import stage
+
+# Shared cache of imported A2L databases.
+#
+# Databases are keyed by the SHA-256 of the A2L content plus the pya2l version, so an
+# edited A2L is always reimported and a renamed copy of the same A2L is a cache hit.
+#
+# A2L_CACHE_DIR        cache directory (default: ~/.cache/a2l2xdf)
+# A2L_CACHE_MAX_BYTES  total size of the cache before least recently used dbs are evicted (default: 10 GB)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "a2l2xdf")
+DEFAULT_CACHE_MAX_BYTES = 10 * 1024 ** 3
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def cache_dir():
+    return os.environ.get("A2L_CACHE_DIR") or DEFAULT_CACHE_DIR
+
+
+def cache_max_bytes():
+    return int(os.environ.get("A2L_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES))
+
+
+def pya2l_version():
+    try:
+        return metadata.version("pya2ldb")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def a2l_cache_key(a2l_path):
+    sha256 = hashlib.sha256()
+    with open(a2l_path, "rb") as a2l:
+        for chunk in iter(lambda: a2l.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return f"{sha256.hexdigest()}-{pya2l_version()}"
+
+
+def import_to_cache(a2l_path, cache_base):
+    """
+    Import the A2L in a private temporary directory inside the cache and move the db into place
+    with an atomic rename, so parallel jobs never see (or corrupt) a half written db.
+    """
+    from pya2l import DB
+
+    directory = os.path.dirname(cache_base)
+    key = os.path.basename(cache_base)
+    with tempfile.TemporaryDirectory(dir=directory, prefix=".import-") as import_dir:
+        # pya2l writes the db next to the A2L it imports, so give it a copy named after the key
+        import_a2l = os.path.join(import_dir, f"{key}.a2l")
+        try:
+            os.link(a2l_path, import_a2l)
+        except OSError:
+            shutil.copyfile(a2l_path, import_a2l)
+        close_a2l(DB().import_a2l(import_a2l))
+        os.replace(os.path.join(import_dir, f"{key}.a2ldb"), f"{cache_base}.a2ldb")
+
+
+def close_a2l(session):
+    """
+    Close a session and dispose of its engine. pya2l opens dbs with LOCKING_MODE=EXCLUSIVE, so
+    the db stays locked for every other session (and process) until then.
+    """
+    session.close()
+    session.get_bind().dispose()
+
+
+def cache_files(cache_key):
+    """The cache files named after an A2L's cache key: its db and table snapshot."""
+    return [f"{cache_key}.a2ldb", f"{cache_key}.tabledefs"]
+
+
+def evict(directory, max_bytes, keep):
+    """
+    Remove least recently used dbs (and table snapshots / fragments) until the cache fits in
+    max_bytes, never removing the files named in keep.
+    """
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith((".a2ldb", ".tabledefs", ".fragments")):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, db_path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if os.path.basename(db_path) in keep:
+            continue
+        try:
+            os.remove(db_path)
+            total -= size
+            print("A2L cache evicted: ", os.path.basename(db_path))
+        except OSError:
+            # In use by another job (Windows) or already evicted by one
+            pass
+
+
+def open_a2l(a2l_path, cache_key=None, keep=()):
+    """
+    Open the imported db for an A2L from the shared cache, importing it on a miss. Pass the
+    cache_key when it is already known, to skip hashing the A2L again. Eviction never removes
+    the A2L's own cache files, nor the cache files named in keep (like the run's fragments).
+    """
+    # Imported here so the cache keys can be used without pya2l installed
+    from pya2l import DB
+
+    directory = cache_dir()
+    os.makedirs(directory, exist_ok=True)
+    if cache_key is None:
+        with stage("a2l.hash"):
+            cache_key = a2l_cache_key(a2l_path)
+    cache_base = os.path.join(directory, cache_key)
+    db_path = f"{cache_base}.a2ldb"
+
+    if os.path.exists(db_path):
+        print("A2L cache hit: ", a2l_path, "->", db_path)
+        # Touch the db so eviction is least recently used, not least recently imported
+        os.utime(db_path, None)
+    else:
+        print("A2L cache miss: ", a2l_path, "->", db_path)
+        with stage("a2l.import"):
+            import_to_cache(a2l_path, cache_base)
+
+    keep = set(cache_files(cache_key)) | {os.path.basename(path) for path in keep}
+    evict(directory, cache_max_bytes(), keep)
+    with stage("a2l.open"):
+        return DB().open_existing(f"{cache_base}.a2l")
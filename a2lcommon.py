@@ -0,0 +1,204 @@
+import csv
+import os
+import re
+import tempfile
+
+from os import path
+
+# Helpers shared by the A2L converters (a2l2xdf.py, a2l2xdf-dsg.py, a2l2xml.py)
+
+data_sizes = {
+    "UWORD": 2,
+    "UBYTE": 1,
+    "SBYTE": 1,
+    "SWORD": 2,
+    "ULONG": 4,
+    "SLONG": 4,
+    "FLOAT32_IEEE": 4,
+}
+
+csv_rows_cache = {}
+
+
+def fix_degree(bad_string):
+    return re.sub(
+        "\uFFFD", "\u00B0", bad_string
+    )  # Replace Unicode "unknown" with degree sign
+
+
+def calc_map_size(table):
+    map_size = data_sizes[table.data_size]
+    for length in table.dimensions:
+        map_size *= length
+    return map_size
+
+
+def load_csv_rows(csv_path):
+    """
+    Read a table CSV (Category 1, Category 2, Category 3, Table Name, Custom Name)
+    into a list of row dicts. Rows are cached per path and modification time, so the
+    jobs of a batch worker only parse each file once.
+    """
+    key = (path.abspath(csv_path), path.getmtime(csv_path))
+    if key not in csv_rows_cache:
+        with open(csv_path, encoding="utf-8-sig") as csvfile:
+            csv_rows_cache[key] = list(csv.DictReader(csvfile))
+    return csv_rows_cache[key]
+
+
+def take_options(argv, names, flags=(), counts=()):
+    """
+    Split "--name value" / "--name=value" options (and "--flag" options, which never take a
+    value) out of a converter's argv. Options in counts (like --workers) only take the next
+    argument when it is a number, so "--workers file.pdx" leaves the path in place.
+    Returns the remaining arguments and a name -> value dict ("" for an option given without a value).
+    """
+    remaining = []
+    options = {}
+    index = 0
+    while index < len(argv):
+        option, equals, value = argv[index].partition("=")
+        index += 1
+        if option in flags:
+            options[option] = ""
+            continue
+        if option not in names and option not in counts:
+            remaining.append(argv[index - 1])
+            continue
+        if (
+            not equals
+            and index < len(argv)
+            and not argv[index].startswith("--")
+            and (option not in counts or argv[index].isdigit())
+        ):
+            value = argv[index]
+            index += 1
+        options[option] = value
+    return remaining, options
+
+
+def write_atomic(file_path, data, prefix=".tmp-"):
+    """Write to a temporary file and rename it into place, so parallel jobs never read a partial file."""
+    directory = path.dirname(path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=prefix)
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def output_names(file_paths):
+    """
+    Output name of each input file: its file name without extension, prefixed with its folder's
+    name when another input has the same file name, and numbered if that still clashes.
+    """
+    stems = [path.splitext(path.basename(file_path))[0] for file_path in file_paths]
+    stem_counts = {}
+    for stem in stems:
+        stem_counts[stem] = stem_counts.get(stem, 0) + 1
+    names = []
+    for file_path, stem in zip(file_paths, stems):
+        name = stem
+        if stem_counts[stem] > 1:
+            name = f"{path.basename(path.dirname(path.abspath(file_path)))}_{stem}"
+        unique_name = name
+        number = 2
+        while unique_name in names:
+            unique_name = f"{name}_{number}"
+            number += 1
+        names.append(unique_name)
+    return names
+
+
+class CategoryRegistry:
+    """
+    Insertion-ordered category name -> index table, so looking up a table's
+    CATEGORYMEM index is a dict lookup instead of a list.index scan.
+    """
+
+    def __init__(self):
+        self.indices = {}
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __contains__(self, name):
+        return name in self.indices
+
+    def add(self, name):
+        index = self.indices.get(name)
+        if index is None:
+            index = self.indices[name] = len(self.indices)
+        return index
+
+    def index(self, name):
+        return self.indices[name]
+
+    def items(self):
+        return self.indices.items()
+
+
+class AxisIndex:
+    """
+    Shared axis tables keyed by (address, length, datatype) with reference counts,
+    so each axis table is emitted once however many maps use it.
+    """
+
+    def __init__(self):
+        self.references = {}
+
+    def __len__(self):
+        return len(self.references)
+
+    def add(self, address, length, data_size, name):
+        """Count a reference to an axis, returns True the first time the axis is seen."""
+        key = (address, length, data_size)
+        reference = self.references.get(key)
+        if reference is None:
+            self.references[key] = [name, 1]
+            return True
+        reference[1] += 1
+        return False
+
+    def shared(self):
+        """(address, length, data_size, name, count) for every axis used by more than one map, most used first."""
+        shared = [
+            (*key, name, count) for key, (name, count) in self.references.items() if count > 1
+        ]
+        return sorted(shared, key=lambda axis: (-axis[4], axis[0]))
+
+
+class AddressRanges:
+    """
+    [start, end) bin ranges of emitted tables and axes, checked once every table is built:
+    one sort, then a sweep that carries the range reaching furthest so far, so overlaps are
+    found in O(n log n) rather than by comparing every pair. The same range added twice under
+    the same name (a table listed twice) counts once.
+    """
+
+    def __init__(self):
+        self.ranges = set()
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def add(self, start, size, name):
+        self.ranges.add((start, start + size, name))
+
+    def outside(self, region_size):
+        """Ranges that do not fit in a region of region_size bytes starting at 0, by address."""
+        return sorted(r for r in self.ranges if r[0] < 0 or r[1] > region_size)
+
+    def overlaps(self):
+        """(earlier, later) pairs of overlapping ranges, each range paired with the earlier one reaching furthest."""
+        overlaps = []
+        reach = None
+        for current in sorted(self.ranges):
+            if reach is not None and current[0] < reach[1]:
+                overlaps.append((reach, current))
+            if reach is None or current[1] > reach[1]:
+                reach = current
+        return overlaps
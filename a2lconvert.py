@@ -0,0 +1,229 @@
+import os
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+from a2lcommon import load_csv_rows, take_options
+from a2lprofile import profile_argv, stage
+from a2lresolve import partition
+from fragments import fragment_cache_path
+from tabledefs import load_table_defs
+from xdfemit import XdfEmitter
+from xmlemit import XmlEmitter
+
+# CLI arguments: a2lconvert.py [a2l] [csv or ALL] [base offset] [format...] [--profile report.json] [--workers N]
+#
+# Writes several definition files from one pass over the A2L: every table is resolved once
+# and handed to each output in turn. Formats:
+#
+#   xdf          TunerPro XDF                  <a2l>.<csv>.xdf
+#   dsg          TunerPro XDF for DSG (DQ250)  <a2l>.<csv>.dsg.xdf
+#   xml-Simos18  ECU definition XML            <a2l>.<csv>.xml
+#   xml-DQ250    ECU definition XML            <a2l>.<csv>.xml
+#
+# a2l2xdf.py, a2l2xdf-dsg.py and a2l2xml.py are this pipeline with a single output.
+# All of them take the --profile options described in a2lprofile.py, and --workers N to run
+# ALL mode on N processes (--workers alone uses every CPU). Parallel runs write the same files.
+
+# Tables per task handed to a worker when rendering in parallel
+RENDER_CHUNK = 64
+
+
+def output_path(a2l_path, selection, extension):
+    return f"{a2l_path.strip('.a2l')}.{selection.strip('.csv')}.{extension}"
+
+
+def emitter_for_format(output_format, a2l_path, selection, offset):
+    if output_format == "xdf":
+        return XdfEmitter(output_path(a2l_path, selection, "xdf"), a2l_path, offset)
+    if output_format == "dsg":
+        return XdfEmitter(output_path(a2l_path, selection, "dsg.xdf"), a2l_path, offset, dsg=True)
+    if output_format.startswith("xml-"):
+        ecu = output_format[len("xml-"):]
+        return XmlEmitter(output_path(a2l_path, selection, "xml"), a2l_path, ecu, offset)
+    raise ValueError(f"Unknown format {output_format}, expected xdf, dsg, xml-Simos18 or xml-DQ250")
+
+
+def converter_argv(argv):
+    """
+    Take the --profile and --workers options out of a converter's argv.
+    Returns the remaining arguments and the keyword arguments for convert().
+    """
+    argv, profiler = profile_argv(argv)
+    argv, options = take_options(argv, (), counts=("--workers",))
+    workers = 1
+    if "--workers" in options:
+        workers = int(options["--workers"]) if options["--workers"] else os.cpu_count()
+    return argv, {"profiler": profiler, "workers": workers}
+
+
+def lookup_table(snapshot, tablename):
+    if tablename in snapshot.axis_pts:
+        print("******** Skipping Axis Pt Table ! ", tablename)
+        return None
+    c_data = snapshot.get(tablename)
+    if c_data is None:
+        print("******** Could not find ! ", tablename)
+        return None
+    print("Table: ", tablename)
+    return c_data
+
+
+def emit_table(snapshot, emitters, tablename, category, sub_category, subsub_category, custom_name, profiler=None):
+    c_data = lookup_table(snapshot, tablename)
+    if c_data is None:
+        return
+    start = time.perf_counter()
+    for emitter in emitters:
+        emitter.build_table(c_data, category, sub_category, subsub_category, custom_name)
+    if profiler is not None:
+        profiler.characteristic(c_data, time.perf_counter() - start)
+
+
+def render_fragments(spec, render_args):
+    """
+    Render prepared tables in a worker process, with an emitter made from spec.
+    Returns the fragments and the time each took, for the profiler.
+    """
+    emitter_class, emitter_args = spec
+    emitter = emitter_class(*emitter_args)
+    fragments = []
+    seconds = []
+    for args in render_args:
+        start = time.perf_counter()
+        fragments.append(emitter.render(*args))
+        seconds.append(time.perf_counter() - start)
+    return fragments, seconds
+
+
+def build_all_parallel(snapshot, memberships, emitters, workers, profiler=None):
+    """
+    ALL mode with the rendering on a process pool. Everything that depends on earlier tables
+    (category indices, which table first emits an axis) is decided by prepare() here, in table
+    order, and the fragments are written in that same order, so the files match a serial run.
+    With a profiler, each characteristic is timed as its prepare() calls plus its rendering in
+    the workers.
+    """
+    prepared = [[] for _ in emitters]
+    characteristics = []
+    seconds = []
+    for membership in memberships:
+        targets = [index for index, emitter in enumerate(emitters) if emitter.membership == membership]
+        for group_name, names in snapshot.memberships[membership]:
+            for name in names:
+                c_data = lookup_table(snapshot, name)
+                if c_data is None:
+                    continue
+                start = time.perf_counter()
+                for index in targets:
+                    # [key, fragment, render args, index of the characteristic]
+                    prepared[index].append(
+                        list(emitters[index].prepare(c_data, group_name, "", "", "")) + [len(characteristics)]
+                    )
+                characteristics.append(c_data)
+                seconds.append(time.perf_counter() - start)
+
+    with stage("render"), ProcessPoolExecutor(max_workers=workers) as executor:
+        for emitter, tables in zip(emitters, prepared):
+            pending = [table for table in tables if table[1] is None]
+            chunks = partition(pending, max(workers, (len(pending) + RENDER_CHUNK - 1) // RENDER_CHUNK))
+            results = executor.map(
+                render_fragments,
+                [emitter.spec()] * len(chunks),
+                [[table[2] for table in chunk] for chunk in chunks],
+            )
+            for chunk, (fragments, render_seconds) in zip(chunks, results):
+                for table, fragment, table_seconds in zip(chunk, fragments, render_seconds):
+                    table[1] = fragment
+                    seconds[table[3]] += table_seconds
+
+    for emitter, tables in zip(emitters, prepared):
+        for key, fragment, _, _ in tables:
+            emitter.write(key, fragment)
+    if profiler is not None:
+        for c_data, table_seconds in zip(characteristics, seconds):
+            profiler.characteristic(c_data, table_seconds)
+
+
+def convert(a2l_path, selection, emitters, profiler=None, workers=1):
+    """
+    Build every table named in the selection CSV (or, for ALL, every table of each emitter's
+    FUNCTION / GROUP membership) into all of the emitters.
+    With a profiler, the run is profiled and its report written once it finishes. With more
+    than one worker, ALL mode resolves and renders its tables on a process pool.
+    """
+    if profiler is None:
+        build_tables(a2l_path, selection, emitters, workers=workers)
+        return
+    profiler.start()
+    try:
+        build_tables(a2l_path, selection, emitters, profiler, workers)
+    finally:
+        profiler.stop()
+        profiler.write()
+
+
+def build_tables(a2l_path, selection, emitters, profiler=None, workers=1):
+    # The previous fragments of the outputs are read after the A2L is opened, which must not evict them
+    keep = [fragment_cache_path(emitter.filename) for emitter in emitters]
+    if selection == "ALL":
+        memberships = list(
+            dict.fromkeys(emitter.membership for emitter in emitters if emitter.membership is not None)
+        )
+        with stage("resolve"):
+            snapshot = load_table_defs(a2l_path, memberships=memberships, workers=workers, keep=keep)
+    else:
+        with stage("csv"):
+            rows = load_csv_rows(selection)
+        with stage("resolve"):
+            snapshot = load_table_defs(a2l_path, [row["Table Name"] for row in rows], keep=keep)
+
+    with stage("build"):
+        try:
+            for emitter in emitters:
+                emitter.open(snapshot.segments)
+
+            if selection == "ALL" and workers > 1:
+                build_all_parallel(snapshot, memberships, emitters, workers, profiler)
+
+            elif selection == "ALL":
+                for membership in memberships:
+                    targets = [emitter for emitter in emitters if emitter.membership == membership]
+                    for group_name, names in snapshot.memberships[membership]:
+                        for name in names:
+                            emit_table(snapshot, targets, name, group_name, "", "", "", profiler)
+
+            else:
+                missing = [name for name in dict.fromkeys(row["Table Name"] for row in rows) if name in snapshot.missing]
+                if len(missing) > 0:
+                    print(f"******** Could not find {len(missing)} tables ! ", ", ".join(missing))
+                for row in rows:
+                    if row["Table Name"] in snapshot.missing:
+                        continue
+                    emit_table(snapshot, emitters, row["Table Name"], row["Category 1"], row["Category 2"], row["Category 3"], row["Custom Name"], profiler)
+        except BaseException:
+            # Close the outputs without finishing them, so no truncated file or open handle is left
+            for emitter in emitters:
+                emitter.abort()
+            raise
+
+    for emitter in emitters:
+        emitter.close()
+
+
+def main():
+    argv, options = converter_argv(sys.argv)
+    a2l_path, selection, offset = argv[1:4]
+    emitters = [
+        emitter_for_format(output_format, a2l_path, selection, offset)
+        for output_format in dict.fromkeys(argv[4:] or ["xdf"])
+    ]
+    filenames = [emitter.filename for emitter in emitters]
+    if len(set(filenames)) != len(filenames):
+        raise ValueError(f"Formats would write the same file: {', '.join(filenames)}")
+    convert(a2l_path, selection, emitters, **options)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import csv
+import os
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from os import path
+
+import numpy as np
+
+from a2lbincompare import a2l_base_address, base_option, characteristic_names, fleet_bin_paths, open_bin
+from a2lcommon import calc_map_size, data_sizes, output_names, take_options
+from a2lvalues import DEFAULT_BYTE_ORDER, cell_counts, cell_map_index, decode_values, point_counts
+from tabledefs import axis_points_address, load_table_defs
+
+# CLI arguments: a2lextract.py [a2l] [bin or directory...] [--output directory] [--format npz|csv|parquet]
+#                [--search term] [--base address] [--byte-order MSB_FIRST] [--dsg] [--workers N]
+#
+# Decodes the values of the characteristics (those matching --search if given) and their
+# COM_AXIS / STD_AXIS points out of every bin (every .bin of a directory) into
+# [output directory]/[bin name].[format] (bins of the same name in different directories get
+# [directory]_[bin name]):
+#
+#   npz      name, first_cell and cells locate each map's values in values, in bin order (x
+#            fastest, like the XDFs lay them out, so they reshape to (cells / x_count, x_count)).
+#            x_first / x_points and y_first / y_points locate its axis points in x_values /
+#            y_values, with 0 points where it has none.
+#   csv      a row per cell: name, x_index, y_index, x, y, value
+#   parquet  the same columns as csv, needs pyarrow
+#
+# Values are physical, through each map's and axis' linear COMPU_METHOD (raw without one).
+# COM_AXIS points follow their point count, except with --dsg, for DSG (DQ250) A2Ls whose
+# AXIS_PTS hold only the points (the layout a2l2xdf-dsg.py writes).
+# Maps and axes that do not fit in a bin are left out of its output. The layout is worked out
+# once, then each bin is decoded in one vectorised pass per datatype, on a process pool.
+
+OUTPUT_FORMATS = ("npz", "csv", "parquet")
+CELL_COLUMNS = ["name", "x_index", "y_index", "x", "y", "value"]
+
+
+class ExtractLayout:
+    """
+    Where the values of each map and the points of its axes are in a bin, as arrays, so every
+    bin of the A2L is decoded without looking at the table definitions again.
+    """
+
+    def __init__(self, tables, base_address, dsg=False):
+        self.tables = tables
+        self.names = np.array([table.name for table in tables])
+        self.counts = cell_counts(tables)
+        self.offsets = np.array([table.address - base_address for table in tables], dtype=np.int64)
+        self.sizes = np.array([calc_map_size(table) for table in tables], dtype=np.int64)
+        self.x_counts = np.array(
+            [table.dimensions[0] if len(table.dimensions) > 0 else 1 for table in tables], dtype=np.int64
+        )
+        # "x" / "y" -> indices of the maps with that axis, their AxisDefs and the offsets and sizes of the points
+        self.axes = {}
+        for axis_index, axis_name in enumerate(("x", "y")):
+            maps = [
+                index
+                for index, table in enumerate(tables)
+                if len(table.axes) > axis_index
+                and table.axes[axis_index] is not None
+                and table.axes[axis_index].address is not None
+            ]
+            axes = [tables[index].axes[axis_index] for index in maps]
+            offsets = np.array([axis_points_address(axis, dsg) - base_address for axis in axes], dtype=np.int64)
+            sizes = np.array([axis.length * data_sizes[axis.data_size] for axis in axes], dtype=np.int64)
+            self.axes[axis_name] = (np.array(maps, dtype=np.int64), axes, offsets, sizes)
+
+
+def fits(offsets, sizes, data):
+    return (offsets >= 0) & (offsets + sizes <= len(data))
+
+
+def extract(layout, data, byte_order=DEFAULT_BYTE_ORDER):
+    """Decode the maps and axes of a bin, returns the columns of the .npz."""
+    in_bin = fits(layout.offsets, layout.sizes, data)
+    maps = np.flatnonzero(in_bin)
+    counts = layout.counts[maps]
+    columns = {
+        "name": layout.names[maps],
+        "first_cell": np.cumsum(counts) - counts,
+        "cells": counts,
+        "x_count": layout.x_counts[maps],
+        "values": decode_values(data, [layout.tables[index] for index in maps], layout.offsets[maps], counts, byte_order),
+    }
+    for axis_name, (axis_maps, axes, offsets, sizes) in layout.axes.items():
+        points = point_counts(axes)
+        decoded = np.flatnonzero(in_bin[axis_maps] & fits(offsets, sizes, data))
+        # Points per map, 0 for maps without the axis, in the order of the maps in the bin
+        map_points = np.zeros(len(layout.tables), dtype=np.int64)
+        map_points[axis_maps[decoded]] = points[decoded]
+        map_points = map_points[maps]
+        columns[axis_name + "_first"] = np.cumsum(map_points) - map_points
+        columns[axis_name + "_points"] = map_points
+        columns[axis_name + "_values"] = decode_values(
+            data, [axes[index] for index in decoded], offsets[decoded], points[decoded], byte_order
+        )
+    return columns
+
+
+def axis_values(columns, axis_name, map_index, point_index):
+    """The value of each cell's axis point, NaN where the map has no such axis (or point)."""
+    first = columns[axis_name + "_first"][map_index]
+    has_point = point_index < columns[axis_name + "_points"][map_index]
+    values = columns[axis_name + "_values"]
+    if len(values) == 0:
+        return np.full(len(map_index), np.nan)
+    return np.where(has_point, values[np.minimum(first + point_index, len(values) - 1)], np.nan)
+
+
+def cell_columns(columns):
+    """The .npz columns as a row per cell, with each cell's x / y indices and axis values."""
+    map_index, cell_index = cell_map_index(columns["cells"])
+    x_index = cell_index % columns["x_count"][map_index]
+    y_index = cell_index // columns["x_count"][map_index]
+    return {
+        "name": columns["name"][map_index],
+        "x_index": x_index,
+        "y_index": y_index,
+        "x": axis_values(columns, "x", map_index, x_index),
+        "y": axis_values(columns, "y", map_index, y_index),
+        "value": columns["values"],
+    }
+
+
+def write_cells_csv(output_path, cells):
+    with open(output_path, "w", newline="", encoding="utf-8") as output:
+        writer = csv.writer(output)
+        writer.writerow(CELL_COLUMNS)
+        writer.writerows(zip(*(cells[column].tolist() for column in CELL_COLUMNS)))
+
+
+def write_cells_parquet(output_path, cells):
+    # Imported here so the other formats do not need pyarrow
+    import pyarrow
+    import pyarrow.parquet
+
+    pyarrow.parquet.write_table(pyarrow.table({column: cells[column] for column in CELL_COLUMNS}), output_path)
+
+
+def write_extract(output_path, output_format, columns):
+    if output_format == "npz":
+        np.savez_compressed(output_path, **columns)
+    elif output_format == "csv":
+        write_cells_csv(output_path, cell_columns(columns))
+    else:
+        write_cells_parquet(output_path, cell_columns(columns))
+
+
+# Extract workers decode with the same layout, set up once per process
+extract_layout = None
+
+
+def init_extract_worker(layout):
+    global extract_layout
+    extract_layout = layout
+
+
+def extract_bin(output_dir, output_format, byte_order, bin_path, output_name):
+    """Decode a bin and write its output as output_name, returns the number of maps written."""
+    data = open_bin(bin_path)
+    try:
+        columns = extract(extract_layout, data, byte_order)
+    finally:
+        data.close()
+    output_path = path.join(output_dir, output_name + "." + output_format)
+    write_extract(output_path, output_format, columns)
+    return len(columns["name"])
+
+
+def main(argv):
+    argv, options = take_options(
+        argv, ("--output", "--format", "--search", "--base", "--byte-order"), flags=("--dsg",), counts=("--workers",)
+    )
+    output_dir = options.get("--output") or "extracted"
+    output_format = options.get("--format") or "npz"
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown format {output_format}, use one of {', '.join(OUTPUT_FORMATS)}")
+    byte_order = (options.get("--byte-order") or DEFAULT_BYTE_ORDER).upper()
+    workers = int(options["--workers"]) if options.get("--workers") else os.cpu_count()
+
+    snapshot = load_table_defs(argv[1], memberships=["Characteristic"])
+    names = characteristic_names(snapshot, options.get("--search") or None)
+    tables = [snapshot.get(name) for name in names]
+    base_address = base_option(options)
+    if base_address is None:
+        base_address = a2l_base_address(snapshot)
+    layout = ExtractLayout(tables, base_address, "--dsg" in options)
+
+    bin_paths = fleet_bin_paths(argv[2:])
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    workers = max(1, min(workers, len(bin_paths)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_extract_worker, initargs=(layout,)) as executor:
+        written = list(executor.map(
+            partial(extract_bin, output_dir, output_format, byte_order), bin_paths, output_names(bin_paths)
+        ))
+    for bin_path, map_count in zip(bin_paths, written):
+        if map_count < len(tables):
+            print(f"{bin_path}: {len(tables) - map_count} of {len(tables)} maps outside the bin, left out")
+    print(f"Extracted {len(tables)} maps from {len(bin_paths)} bins on {workers} workers in {time.perf_counter() - start:.1f}s, "
+          f"written to {output_dir}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,242 @@
+import csv
+import mmap
+import os
+import shutil
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from os import path
+
+import numpy as np
+
+from a2lbincompare import a2l_base_address, base_option, characteristic_names, fleet_bin_paths
+from a2lcommon import calc_map_size, data_sizes, output_names, take_options
+from a2lextract import cell_columns, fits
+from a2lvalues import DEFAULT_BYTE_ORDER, encode_cells, gather_cells, physical_cell_values, raw_values
+from tabledefs import axis_points_address, load_table_defs
+
+# CLI arguments: a2lpatch.py [a2l] [values.npz|csv|parquet] [bin or directory...] [--output directory]
+#                [--base address] [--byte-order MSB_FIRST] [--dsg] [--workers N]
+#
+# Writes physical map and axis values into bins (every .bin of a directory), in place, or into
+# copies of them in [output directory] (named like a2lextract.py names its outputs). The values
+# are in a2lextract.py's formats, keyed by characteristic name:
+#
+#   npz            every map in it is written whole, with the points of its axes
+#   csv / parquet  a row per cell to write: name, x_index, y_index, x, y, value. The x axis
+#                  points are taken from the rows with y_index 0, the y axis points from those
+#                  with x_index 0.
+#
+# Only cells whose value differs from the bin's are written, so empty and NaN values, and the
+# unedited cells of an extract, leave the bin as it is. Values are clipped to the A2L limits,
+# turned back into raw values through the inverse of each map's and axis' linear COMPU_METHOD,
+# then rounded and saturated to the datatype. Bins are placed like a2lextract.py places them,
+# --dsg as well. The edits are resolved to bin offsets once, then each bin is patched with one
+# vectorised gather and write per datatype, on a process pool. Checksums are not updated.
+
+
+class PatchPlan:
+    """
+    The cells to write into every bin of the A2L: the maps and axes written (targets), the offsets
+    and sizes of their values in a bin, and per cell its target, position in the target, physical
+    value, raw value and whether that was clipped.
+    """
+
+    def __init__(self, targets, offsets, sizes, target_index, cell_index, physical, raw, clipped):
+        self.targets = targets
+        self.offsets = offsets
+        self.sizes = sizes
+        self.target_index = target_index
+        self.cell_index = cell_index
+        self.physical = physical
+        self.raw = raw
+        self.clipped = clipped
+
+
+def read_cells(values_path):
+    """The cells of a values file as a2lextract.py's csv columns, empty values are NaN."""
+    extension = path.splitext(values_path)[1].lower()
+    if extension == ".npz":
+        with np.load(values_path) as columns:
+            return cell_columns(dict(columns))
+    if extension == ".parquet":
+        # Imported here so the other formats do not need pyarrow
+        import pyarrow.parquet
+
+        columns = pyarrow.parquet.read_table(values_path).to_pydict()
+    else:
+        with open(values_path, newline="", encoding="utf-8") as values_file:
+            rows = list(csv.DictReader(values_file))
+        columns = {column: [row[column] for row in rows] for column in ("name", "x_index", "y_index", "x", "y", "value")}
+    cells = {"name": np.array(columns["name"], dtype=str)}
+    for column in ("x_index", "y_index"):
+        cells[column] = np.array(columns[column], dtype=np.int64)
+    for column in ("x", "y", "value"):
+        cells[column] = np.array([np.nan if value in ("", None) else float(value) for value in columns[column]])
+    return cells
+
+
+def map_axis(table, axis_index):
+    """The AxisDef whose points are stored in the bin, None for missing and FIX_AXIS axes."""
+    if len(table.axes) > axis_index and table.axes[axis_index] is not None and table.axes[axis_index].address is not None:
+        return table.axes[axis_index]
+    return None
+
+
+def patch_plan(tables, table_index, cells, base_address, dsg=False):
+    """
+    Resolve cells (read_cells() columns, table_index giving each cell's map in tables) to the
+    cells of the maps and axes to write. Returns the plan and the number of cells left out for
+    being outside their map.
+    """
+    x_counts = np.array([table.dimensions[0] if len(table.dimensions) > 0 else 1 for table in tables], dtype=np.int64)
+    y_counts = np.array([table.dimensions[1] if len(table.dimensions) > 1 else 1 for table in tables], dtype=np.int64)
+    x_index = cells["x_index"]
+    y_index = cells["y_index"]
+    in_map = (x_index >= 0) & (y_index >= 0) & (x_index < x_counts[table_index]) & (y_index < y_counts[table_index])
+
+    targets = list(tables)
+    offsets = [table.address - base_address for table in tables]
+    sizes = [calc_map_size(table) for table in tables]
+    target_index = [table_index[in_map]]
+    cell_index = [(y_index * x_counts[table_index] + x_index)[in_map]]
+    physical = [cells["value"][in_map]]
+    # x axis points from the first row of each map, y axis points from its first column
+    for axis_name, axis_index, point_index, first in (("x", 0, x_index, y_index == 0), ("y", 1, y_index, x_index == 0)):
+        axis_target = np.full(len(tables), -1, dtype=np.int64)
+        axis_points = np.zeros(len(tables), dtype=np.int64)
+        for index, table in enumerate(tables):
+            axis = map_axis(table, axis_index)
+            if axis is None:
+                continue
+            axis_target[index] = len(targets)
+            axis_points[index] = axis.length
+            targets.append(axis)
+            offsets.append(axis_points_address(axis, dsg) - base_address)
+            sizes.append(axis.length * data_sizes[axis.data_size])
+        on_axis = first & in_map & (point_index < axis_points[table_index])
+        target_index.append(axis_target[table_index][on_axis])
+        cell_index.append(point_index[on_axis])
+        physical.append(cells[axis_name][on_axis])
+
+    target_index = np.concatenate(target_index)
+    cell_index = np.concatenate(cell_index)
+    physical = np.concatenate(physical)
+    written = ~np.isnan(physical)
+    raw, clipped = raw_values(physical[written], targets, target_index[written])
+    plan = PatchPlan(
+        targets,
+        np.array(offsets, dtype=np.int64),
+        np.array(sizes, dtype=np.int64),
+        target_index[written],
+        cell_index[written],
+        physical[written],
+        raw,
+        clipped,
+    )
+    return plan, int((~in_map).sum())
+
+
+# Patch workers write the same plan, set up once per process
+patch_plan_of_worker = None
+
+
+def init_patch_worker(plan):
+    global patch_plan_of_worker
+    patch_plan_of_worker = plan
+
+
+def patch_bin(output_dir, byte_order, bin_path, output_name):
+    """
+    Write the plan's cells that differ from the bin into it (into a copy of it named output_name
+    in output_dir if given). Returns the number of cells written, of those clipped, of changed
+    cells without a raw value, and of maps and axes outside the bin.
+    """
+    plan = patch_plan_of_worker
+    if output_dir:
+        output_path = path.join(output_dir, output_name + path.splitext(bin_path)[1])
+        shutil.copyfile(bin_path, output_path)
+        bin_path = output_path
+    with open(bin_path, "r+b") as bin_file:
+        data = mmap.mmap(bin_file.fileno(), 0, access=mmap.ACCESS_WRITE)
+    try:
+        in_bin = fits(plan.offsets, plan.sizes, data)
+        cells = np.flatnonzero(in_bin[plan.target_index])
+        target_index = plan.target_index[cells]
+        current = physical_cell_values(
+            gather_cells(data, plan.targets, plan.offsets, target_index, plan.cell_index[cells], byte_order),
+            plan.targets,
+            target_index,
+        )
+        # Cells that already hold their value are left alone, even where it is outside the limits
+        cells = cells[current != plan.physical[cells]]
+        unencodable = ~np.isfinite(plan.raw[cells])
+        cells = cells[~unencodable]
+        encode_cells(
+            data,
+            plan.targets,
+            plan.offsets,
+            plan.target_index[cells],
+            plan.cell_index[cells],
+            plan.raw[cells],
+            byte_order,
+        )
+        data.flush()
+    finally:
+        data.close()
+    outside = int((~in_bin[np.unique(plan.target_index)]).sum())
+    return len(cells), int(plan.clipped[cells].sum()), int(unencodable.sum()), outside
+
+
+def main(argv):
+    argv, options = take_options(
+        argv, ("--output", "--base", "--byte-order"), flags=("--dsg",), counts=("--workers",)
+    )
+    output_dir = options.get("--output")
+    byte_order = (options.get("--byte-order") or DEFAULT_BYTE_ORDER).upper()
+    workers = int(options["--workers"]) if options.get("--workers") else os.cpu_count()
+
+    cells = read_cells(argv[2])
+    names, name_index = np.unique(cells["name"], return_inverse=True)
+    # Every characteristic, so the base address is the one a2lextract.py places the bins at
+    snapshot = load_table_defs(argv[1], names.tolist(), memberships=["Characteristic"])
+    characteristics = set(characteristic_names(snapshot))
+    found = np.array([name in characteristics for name in names.tolist()], dtype=bool)
+    if not found.all():
+        missing = names[~found].tolist()
+        print(f"******** Could not find {len(missing)} characteristics ! ", ", ".join(missing))
+    tables = [snapshot.get(name) for name in names[found].tolist()]
+    # Index of each found name's map in tables, the cells of the others are dropped
+    table_of_name = np.cumsum(found) - 1
+    known = found[name_index]
+    cells = {column: values[known] for column, values in cells.items()}
+    base_address = base_option(options)
+    if base_address is None:
+        base_address = a2l_base_address(snapshot)
+    plan, skipped = patch_plan(tables, table_of_name[name_index[known]], cells, base_address, "--dsg" in options)
+    if skipped > 0:
+        print(f"{skipped} cells outside their map, left out")
+
+    bin_paths = fleet_bin_paths(argv[3:])
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    workers = max(1, min(workers, len(bin_paths)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_patch_worker, initargs=(plan,)) as executor:
+        results = list(executor.map(partial(patch_bin, output_dir, byte_order), bin_paths, output_names(bin_paths)))
+    for bin_path, (written, clipped, unencodable, outside) in zip(bin_paths, results):
+        print(f"{written:>8} cells written  {bin_path}")
+        if clipped > 0:
+            print(f"{bin_path}: {clipped} cells clipped to their limits")
+        if unencodable > 0:
+            print(f"{bin_path}: {unencodable} cells without a raw value, left as they are")
+        if outside > 0:
+            print(f"{bin_path}: {outside} maps or axes outside the bin, left as they are")
+    print(f"Patched {len(tables)} maps into {len(bin_paths)} bins on {workers} workers "
+          f"in {time.perf_counter() - start:.1f}s" + (f", written to {output_dir}" if output_dir else ""))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
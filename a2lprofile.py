@@ -0,0 +1,186 @@
+import cProfile
+import heapq
+import importlib.util
+import json
+import sys
+import time
+import tracemalloc
+
+from contextlib import contextmanager, nullcontext
+
+from a2lcommon import take_options
+
+# Opt-in profiling for the converters.
+#
+#   --profile report.json        per-stage wall time, allocations and SQL queries, and the
+#                                slowest characteristics, written as JSON (default a2lprofile.json)
+#   --profile-pstats run.pstats  also dump a cProfile of the whole run (see python -m pstats)
+#   --profile-top N              how many of the slowest characteristics to report (default 20)
+#
+# Stages nest (e.g. import runs inside resolve), the numbers of a stage include its children.
+# Allocation tracking uses tracemalloc, which makes the profiled run itself slower.
+
+DEFAULT_REPORT = "a2lprofile.json"
+DEFAULT_TOP = 20
+
+# The profiler of the running conversion, stage() is a no-op without one
+active = None
+
+
+class StageStats:
+    __slots__ = ("calls", "seconds", "allocated", "peak", "queries")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.allocated = 0
+        self.peak = 0
+        self.queries = 0
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class Profiler:
+    def __init__(self, report_path=DEFAULT_REPORT, pstats_path=None, top=DEFAULT_TOP):
+        self.report_path = report_path
+        self.pstats_path = pstats_path
+        self.top = top
+        self.stages = {}
+        self.frames = []
+        self.queries = 0
+        self.counting_queries = False
+        self.slowest = []
+        self.profile = None
+        self.sql_listener = None
+        self.start_time = None
+        self.total_seconds = 0.0
+        self.peak = 0
+
+    def start(self):
+        global active
+        active = self
+        self.listen_to_queries()
+        tracemalloc.start()
+        if self.pstats_path:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        self.start_time = time.perf_counter()
+
+    def stop(self):
+        global active
+        self.total_seconds = time.perf_counter() - self.start_time
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.pstats_path)
+        self.peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.stop_listening_to_queries()
+        active = None
+
+    def listen_to_queries(self):
+        # Only count queries when SQLAlchemy is there at all, snapshot-only runs never query
+        if importlib.util.find_spec("sqlalchemy") is None:
+            return
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        def count_query(*args):
+            self.queries += 1
+            for frame in self.frames:
+                frame[0].queries += 1
+
+        event.listen(Engine, "before_cursor_execute", count_query)
+        self.sql_listener = count_query
+        self.counting_queries = True
+
+    def stop_listening_to_queries(self):
+        if self.sql_listener is None:
+            return
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        event.remove(Engine, "before_cursor_execute", self.sql_listener)
+        self.sql_listener = None
+
+    @contextmanager
+    def stage(self, name):
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats()
+        current, peak = tracemalloc.get_traced_memory()
+        if self.frames:
+            # reset_peak() below loses the enclosing stage's peak, so carry it over
+            self.frames[-1][1] = max(self.frames[-1][1], peak)
+        tracemalloc.reset_peak()
+        frame = [stats, current]
+        self.frames.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats.seconds += time.perf_counter() - start
+            self.frames.pop()
+            end_current, end_peak = tracemalloc.get_traced_memory()
+            peak = max(frame[1], end_peak)
+            stats.calls += 1
+            stats.allocated += end_current - current
+            stats.peak = max(stats.peak, peak - current)
+            if self.frames:
+                self.frames[-1][1] = max(self.frames[-1][1], peak)
+
+    def characteristic(self, c_data, seconds):
+        """Record the build time of one characteristic, keeping the top N slowest."""
+        entry = (
+            seconds,
+            c_data.name,
+            [axis.kind if axis is not None else None for axis in c_data.axes],
+            list(c_data.dimensions),
+        )
+        if len(self.slowest) < self.top:
+            heapq.heappush(self.slowest, entry)
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def report(self):
+        return {
+            "command": sys.argv,
+            "seconds": self.total_seconds,
+            "peak_allocated": self.peak,
+            "queries": self.queries if self.counting_queries else None,
+            "stages": {name: stats.to_dict() for name, stats in self.stages.items()},
+            "slowest_characteristics": [
+                {"name": name, "seconds": seconds, "axes": axes, "dimensions": dimensions}
+                for seconds, name, axes, dimensions in sorted(self.slowest, reverse=True)
+            ],
+            "pstats": self.pstats_path,
+        }
+
+    def write(self):
+        report = self.report()
+        with open(self.report_path, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=2)
+        print("Profile written to", self.report_path)
+        return report
+
+
+def stage(name):
+    """Time a stage of the running conversion when it is being profiled."""
+    if active is None:
+        return nullcontext()
+    return active.stage(name)
+
+
+def profile_argv(argv):
+    """
+    Take the --profile options out of a converter's argv.
+    Returns the remaining arguments and a Profiler, or None when profiling was not asked for.
+    """
+    remaining, options = take_options(argv, ("--profile", "--profile-pstats", "--profile-top"))
+    if not options:
+        return remaining, None
+    return remaining, Profiler(
+        options.get("--profile") or DEFAULT_REPORT,
+        options.get("--profile-pstats") or None,
+        int(options.get("--profile-top") or DEFAULT_TOP),
+    )
@@ -0,0 +1,447 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from a2lcache import close_a2l, open_a2l
+from a2lcommon import data_sizes, fix_degree
+from a2lprofile import stage
+from pya2l import model
+from pya2l.api import inspect
+from sqlalchemy.orm import selectinload
+from tabledefs import AxisDef, TableDef
+
+# Batched lookups against an imported A2L db, shared by the converters
+
+# SQLite versions before 3.32 only allow 999 bound parameters per statement
+QUERY_BATCH_SIZE = 500
+
+
+def fetch_characteristics(session, names):
+    """
+    Resolve a list of characteristic names with batched IN (...) queries.
+    Returns a name -> model.Characteristic dict and the list of names that were not found,
+    in the order they were requested.
+    AXIS_DESCRs (with their AXIS_PTS_REF) and DISPLAY_IDENTIFIER are loaded in the same pass.
+    """
+    unique_names = list(dict.fromkeys(names))
+    characteristics = {}
+    for start in range(0, len(unique_names), QUERY_BATCH_SIZE):
+        batch = unique_names[start : start + QUERY_BATCH_SIZE]
+        query = (
+            session.query(model.Characteristic)
+            .options(
+                selectinload(model.Characteristic.axis_descr).selectinload(
+                    model.AxisDescr.axis_pts_ref
+                ),
+                selectinload(model.Characteristic.display_identifier),
+            )
+            .filter(model.Characteristic.name.in_(batch))
+        )
+        for characteristic in query:
+            characteristics.setdefault(characteristic.name, characteristic)
+    missing = [name for name in unique_names if name not in characteristics]
+    return characteristics, missing
+
+
+def fetch_axis_pts_names(session, names):
+    """The subset of names that are AXIS_PTS, in batched IN (...) queries."""
+    names = list(dict.fromkeys(names))
+    axis_pts_names = set()
+    for start in range(0, len(names), QUERY_BATCH_SIZE):
+        batch = names[start : start + QUERY_BATCH_SIZE]
+        for (name,) in session.query(model.AxisPts.name).filter(model.AxisPts.name.in_(batch)):
+            axis_pts_names.add(name)
+    return axis_pts_names
+
+
+def membership_model(membership):
+    """The model and its name column for "Function" / "Group" / "Characteristic"."""
+    if membership == "Function":
+        return model.Function, model.Function.name
+    if membership == "Group":
+        return model.Group, model.Group.groupName
+    if membership == "Characteristic":
+        return model.Characteristic, model.Characteristic.name
+    raise ValueError(f"Unknown membership {membership}, expected Function, Group or Characteristic")
+
+
+def fetch_membership_names(session, membership):
+    """Every FUNCTION or GROUP name, sorted."""
+    _, column = membership_model(membership)
+    return [name for (name,) in session.query(column).order_by(column)]
+
+
+def fetch_memberships(session, membership, name_range=None):
+    """
+    [(function or group name, [characteristic names])] for ALL mode, sorted by name.
+    "Characteristic" lists every characteristic as a member of its own, for a2lbincompare.py.
+    name_range limits it to the (first, last) names, inclusive.
+    """
+    membership_class, column = membership_model(membership)
+    if membership == "Characteristic":
+        # Characteristics are their own members, their names are all that is needed
+        membership_class = column
+    query = session.query(membership_class)
+    if name_range is not None:
+        query = query.filter(column.between(*name_range))
+    rows = query.order_by(column).all()
+    if membership == "Characteristic":
+        return [(name, [name]) for (name,) in rows]
+    if membership == "Function":
+        return [
+            (func.name, [char.name for char in inspect.Function(session, func.name).defCharacteristics])
+            for func in rows
+        ]
+    return [
+        (group.groupName, [char.name for char in inspect.Group(session, group.groupName).characteristics])
+        for group in rows
+    ]
+
+
+def resolve_membership_part(a2l_path, cache_key, keep, membership, name_range):
+    """
+    Resolve the FUNCTIONs / GROUPs in name_range and their characteristics, with a session of
+    its own. Runs in a worker process, so it returns plain data for the snapshot.
+    """
+    session = open_a2l(a2l_path, cache_key, keep)
+    resolver = CharacteristicResolver(session)
+    members = fetch_memberships(session, membership, name_range)
+    names = [name for _, member_names in members for name in member_names]
+    characteristics, missing = resolver.prefetch(names)
+    tables = {name: table_def(characteristic).to_tuple() for name, characteristic in characteristics.items()}
+    axis_pts_names = fetch_axis_pts_names(session, missing)
+    # Workers resolve several ranges, the next open_a2l() would find the db locked
+    close_a2l(session)
+    return members, tables, missing, axis_pts_names
+
+
+def partition(items, parts):
+    """Split items into at most parts contiguous, non-empty chunks of about the same size."""
+    size, extra = divmod(len(items), parts)
+    chunks = []
+    start = 0
+    for index in range(parts):
+        end = start + size + (1 if index < extra else 0)
+        if end > start:
+            chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+def resolve_memberships_parallel(snapshot, a2l_path, cache_key, keep, membership_names, workers):
+    """
+    Partition each FUNCTION / GROUP list (membership -> names) into contiguous name ranges and
+    resolve them on a process pool. Ranges are merged back in order, so the snapshot is the same
+    as a serial one. The db must not be open in this process: pya2l locks it exclusively.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for membership, names in membership_names.items():
+            ranges = [(chunk[0], chunk[-1]) for chunk in partition(names, workers)]
+            snapshot.memberships[membership] = []
+            parts = executor.map(
+                resolve_membership_part,
+                [a2l_path] * len(ranges),
+                [cache_key] * len(ranges),
+                [keep] * len(ranges),
+                [membership] * len(ranges),
+                ranges,
+            )
+            for members, tables, missing, axis_pts_names in parts:
+                snapshot.memberships[membership] += members
+                for name, values in tables.items():
+                    snapshot.tables.setdefault(name, values)
+                for name in missing:
+                    if name in axis_pts_names:
+                        snapshot.axis_pts.add(name)
+                    else:
+                        snapshot.missing.add(name)
+            snapshot.changed = True
+
+
+class ResolvedAxisDescr:
+    """
+    The parts of inspect.AxisDescr the converters use, with shared objects
+    (compu method, axis points) coming from the resolver's memo tables.
+    """
+
+    __slots__ = (
+        "attribute",
+        "inputQuantity",
+        "maxAxisPoints",
+        "lowerLimit",
+        "upperLimit",
+        "compuMethod",
+        "axisPtsRef",
+    )
+
+    def __init__(self, resolver, axis_descr):
+        self.attribute = axis_descr.attribute
+        self.inputQuantity = axis_descr.inputQuantity
+        self.maxAxisPoints = axis_descr.maxAxisPoints
+        self.lowerLimit = axis_descr.lowerLimit
+        self.upperLimit = axis_descr.upperLimit
+        self.compuMethod = resolver.compu_method(axis_descr.conversion)
+        self.axisPtsRef = (
+            resolver.axis_pts(axis_descr.axis_pts_ref.axisPoints)
+            if axis_descr.axis_pts_ref
+            else None
+        )
+
+
+class ResolvedCharacteristic:
+    """
+    The parts of inspect.Characteristic the converters use, built from an eager-loaded row.
+    """
+
+    __slots__ = (
+        "name",
+        "longIdentifier",
+        "displayIdentifier",
+        "address",
+        "lowerLimit",
+        "upperLimit",
+        "deposit",
+        "compuMethod",
+        "axisDescriptions",
+    )
+
+    def __init__(self, resolver, characteristic):
+        self.name = characteristic.name
+        self.longIdentifier = characteristic.longIdentifier
+        self.displayIdentifier = (
+            characteristic.display_identifier.display_name
+            if characteristic.display_identifier
+            else None
+        )
+        self.address = characteristic.address
+        self.lowerLimit = characteristic.lowerLimit
+        self.upperLimit = characteristic.upperLimit
+        self.deposit = resolver.record_layout(characteristic.deposit)
+        self.compuMethod = resolver.compu_method(characteristic.conversion)
+        self.axisDescriptions = [
+            ResolvedAxisDescr(resolver, axis_descr) for axis_descr in characteristic.axis_descr
+        ]
+
+
+class CharacteristicResolver:
+    """
+    Resolves characteristics once and memoizes them, together with the RECORD_LAYOUTs,
+    COMPU_METHODs and AXIS_PTS they reference (which are heavily shared between maps).
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.characteristics = {}
+        self.record_layouts = {}
+        self.compu_methods = {"NO_COMPU_METHOD": "NO_COMPU_METHOD"}
+        self.axis_pts_by_name = {}
+
+    def record_layout(self, name):
+        if name not in self.record_layouts:
+            self.record_layouts[name] = inspect.RecordLayout(self.session, name)
+        return self.record_layouts[name]
+
+    def compu_method(self, name):
+        if name not in self.compu_methods:
+            self.compu_methods[name] = inspect.CompuMethod(self.session, name)
+        return self.compu_methods[name]
+
+    def axis_pts(self, name):
+        if name not in self.axis_pts_by_name:
+            self.axis_pts_by_name[name] = inspect.AxisPts(self.session, name)
+        return self.axis_pts_by_name[name]
+
+    def prefetch(self, names):
+        """
+        Resolve every name not already known in one batched, eager-loaded pass.
+        Returns a name -> ResolvedCharacteristic dict for the requested names and the missing names.
+        """
+        characteristics, missing = fetch_characteristics(
+            self.session, [name for name in names if name not in self.characteristics]
+        )
+        for name, characteristic in characteristics.items():
+            self.characteristics[name] = ResolvedCharacteristic(self, characteristic)
+        resolved = {name: self.characteristics[name] for name in names if name in self.characteristics}
+        return resolved, missing
+
+    def get(self, name):
+        if name not in self.characteristics:
+            self.prefetch([name])
+        return self.characteristics.get(name)
+
+
+# Conversion to the pya2l independent TableDef / AxisDef records
+
+
+def compu_units(compu_method):
+    if compu_method == "NO_COMPU_METHOD":
+        return ""
+    return fix_degree(compu_method.unit)
+
+
+def compu_coeffs(compu_method):
+    if compu_method == "NO_COMPU_METHOD" or len(compu_method.coeffs) == 0:
+        return None
+    coeffs = compu_method.coeffs
+    return (coeffs["a"], coeffs["b"], coeffs["c"], coeffs["d"], coeffs["e"], coeffs["f"])
+
+
+def compu_conversion_type(compu_method):
+    if compu_method == "NO_COMPU_METHOD":
+        return "NO_COMPU_METHOD"
+    return compu_method.conversionType
+
+
+def compu_values(compu_method):
+    if compu_conversion_type(compu_method) != "TAB_VERB":
+        return None
+    return tuple(compu_method.tab_verb["text_values"])
+
+
+def std_axis_size(c_data, index):
+    """
+    Bytes of a STD_AXIS in front of the map values: its point count and maxAxisPoints points,
+    in the layout's AXIS_PTS datatype. pya2l only adds this (memSize) to the RECORD_LAYOUT of an
+    inspected Characteristic, and it depends on the characteristic, so the shared layouts lack it.
+    """
+    axis_pts = c_data.deposit.axisPts["xy"[index]]
+    return data_sizes[axis_pts["datatype"]] * (1 + c_data.axisDescriptions[index].maxAxisPoints)
+
+
+def axis_def(axis_ref, c_data, index):
+    compu_method = axis_ref.compuMethod
+    if axis_ref.attribute == "STD_AXIS":
+        # STD_AXIS points are stored in the map itself: [x count][x points][y count][y points][values]
+        if index == 0:
+            address = c_data.address
+            axis_pts = c_data.deposit.axisPts["x"]
+        else:
+            address = c_data.address + std_axis_size(c_data, 0)
+            axis_pts = c_data.deposit.axisPts["y"]
+        return AxisDef(
+            "STD_AXIS",
+            axis_ref.inputQuantity,
+            compu_units(compu_method),
+            axis_ref.lowerLimit,
+            axis_ref.upperLimit,
+            address,
+            data_sizes[axis_pts["datatype"]],
+            axis_ref.maxAxisPoints,
+            axis_pts["datatype"],
+            compu_coeffs(compu_method),
+            compu_conversion_type(compu_method),
+            compu_values(compu_method),
+        )
+    if axis_ref.attribute == "FIX_AXIS":
+        return AxisDef(
+            "FIX_AXIS",
+            axis_ref.inputQuantity,
+            compu_units(compu_method),
+            axis_ref.lowerLimit,
+            axis_ref.upperLimit,
+            None,
+            0,
+            axis_ref.maxAxisPoints,
+            "UBYTE",
+            compu_coeffs(compu_method),
+            compu_conversion_type(compu_method),
+            compu_values(compu_method),
+        )
+    if hasattr(axis_ref.axisPtsRef, "address"):
+        axis_pts = axis_ref.axisPtsRef
+        data_size = axis_pts.depositAttr.axisPts["x"]["datatype"]
+        return AxisDef(
+            "COM_AXIS",
+            axis_pts.name,
+            compu_units(axis_pts.compuMethod),
+            axis_ref.lowerLimit,
+            axis_ref.upperLimit,
+            axis_pts.address,
+            data_sizes[data_size],
+            axis_ref.maxAxisPoints,
+            data_size,
+            compu_coeffs(compu_method),
+            compu_conversion_type(compu_method),
+            compu_values(compu_method),
+        )
+    return None
+
+
+def table_def(c_data):
+    axisDescriptions = c_data.axisDescriptions
+    address = c_data.address
+    if len(axisDescriptions) > 0 and axisDescriptions[0].attribute == "STD_AXIS":
+        address = c_data.address + std_axis_size(c_data, 0)
+    if len(axisDescriptions) > 1 and axisDescriptions[1].attribute == "STD_AXIS":
+        address = c_data.address + std_axis_size(c_data, 0) + std_axis_size(c_data, 1)
+    return TableDef(
+        c_data.name,
+        c_data.longIdentifier,
+        c_data.displayIdentifier,
+        address,
+        c_data.deposit.fncValues["datatype"],
+        c_data.lowerLimit,
+        c_data.upperLimit,
+        compu_units(c_data.compuMethod),
+        compu_coeffs(c_data.compuMethod),
+        compu_conversion_type(c_data.compuMethod),
+        tuple(axis_ref.maxAxisPoints for axis_ref in axisDescriptions),
+        tuple(
+            axis_def(axis_ref, c_data, index)
+            for index, axis_ref in enumerate(axisDescriptions[:2])
+        ),
+    )
+
+
+def complete_snapshot(snapshot, a2l_path, cache_key, names, memberships=(), workers=1, keep=()):
+    """
+    Resolve the given names (and ALL mode membership lists) from the A2L into a TableDefSnapshot.
+    With more than one worker, membership lists are resolved on a process pool.
+    """
+    session = open_a2l(a2l_path, cache_key, keep)
+
+    if len(snapshot.segments) == 0:
+        snapshot.segments = {
+            segment.name: segment.address for segment in session.query(model.MemorySegment)
+        }
+        snapshot.changed = True
+
+    names = list(names)
+    memberships = [membership for membership in memberships if membership not in snapshot.memberships]
+    if workers > 1 and len(memberships) > 0:
+        membership_names = {membership: fetch_membership_names(session, membership) for membership in memberships}
+        # The workers open the db themselves, which they cannot while this session holds its lock
+        close_a2l(session)
+        session = None
+        with stage("resolve.memberships"):
+            resolve_memberships_parallel(snapshot, a2l_path, cache_key, keep, membership_names, workers)
+        memberships = []
+        if len(snapshot.unresolved(names)) == 0:
+            return snapshot
+        session = open_a2l(a2l_path, cache_key, keep)
+
+    try:
+        for membership in memberships:
+            with stage("resolve.memberships"):
+                snapshot.memberships[membership] = fetch_memberships(session, membership)
+            snapshot.changed = True
+            names += [name for _, members in snapshot.memberships[membership] for name in members]
+
+        unresolved = snapshot.unresolved(names)
+        resolver = CharacteristicResolver(session)
+        with stage("resolve.characteristics"):
+            characteristics, missing = resolver.prefetch(unresolved)
+        with stage("resolve.table_defs"):
+            for name in unresolved:
+                if name in characteristics:
+                    snapshot.add(table_def(characteristics[name]))
+
+        with stage("resolve.axis_pts"):
+            axis_pts_names = fetch_axis_pts_names(session, missing)
+    finally:
+        close_a2l(session)
+    for name in missing:
+        if name in axis_pts_names:
+            snapshot.axis_pts.add(name)
+        else:
+            snapshot.missing.add(name)
+        snapshot.changed = True
+    return snapshot
@@ -0,0 +1,207 @@
+import csv
+import random
+import sys
+
+# Synthetic A2L generator for benchmarking the converters without shipping real A2Ls.
+#
+# CLI arguments: a2lsynth.py [a2l] [characteristics] [csv?]
+#
+# The A2L has a _ROM MEMORY_SEGMENT at 0x80000000 and a mix of VALUE, CURVE and MAP
+# CHARACTERISTICs. Axes are either COM_AXIS, referencing a pool of shared AXIS_PTS, or
+# STD_AXIS, stored in front of the map values. Conversions come from a pool of linear
+# RAT_FUNC COMPU_METHODs (floats have none), and every characteristic belongs to one
+# FUNCTION and one GROUP under a ROOT group / parent function.
+
+ROM_ADDRESS = 0x80000000
+AXIS_PTS_ADDRESS = 0x80010000
+CHARACTERISTIC_ADDRESS = 0x80100000
+
+X_POINTS = 16
+Y_POINTS = 12
+
+datatypes = {
+    "UBYTE": 1,
+    "UWORD": 2,
+    "SWORD": 2,
+    "FLOAT32_IEEE": 4,
+}
+
+
+def record_layouts(a2l):
+    for datatype in datatypes:
+        a2l.write(
+            f"    /begin RECORD_LAYOUT RL_VALUE_{datatype}\n"
+            f"      FNC_VALUES 1 {datatype} COLUMN_DIR DIRECT\n"
+            f"    /end RECORD_LAYOUT\n"
+            f"    /begin RECORD_LAYOUT RL_AXIS_{datatype}\n"
+            f"      NO_AXIS_PTS_X 1 {datatype}\n"
+            f"      AXIS_PTS_X 2 {datatype} INDEX_INCR DIRECT\n"
+            f"    /end RECORD_LAYOUT\n"
+            f"    /begin RECORD_LAYOUT RL_STD_CURVE_{datatype}\n"
+            f"      NO_AXIS_PTS_X 1 {datatype}\n"
+            f"      AXIS_PTS_X 2 {datatype} INDEX_INCR DIRECT\n"
+            f"      FNC_VALUES 3 {datatype} COLUMN_DIR DIRECT\n"
+            f"    /end RECORD_LAYOUT\n"
+            f"    /begin RECORD_LAYOUT RL_STD_MAP_{datatype}\n"
+            f"      NO_AXIS_PTS_X 1 {datatype}\n"
+            f"      AXIS_PTS_X 2 {datatype} INDEX_INCR DIRECT\n"
+            f"      NO_AXIS_PTS_Y 3 {datatype}\n"
+            f"      AXIS_PTS_Y 4 {datatype} INDEX_INCR DIRECT\n"
+            f"      FNC_VALUES 5 {datatype} COLUMN_DIR DIRECT\n"
+            f"    /end RECORD_LAYOUT\n"
+        )
+
+
+def compu_methods(a2l, count):
+    for index in range(count):
+        factor = 2 ** (index % 8) / 10 ** (index % 3)
+        a2l.write(
+            f'    /begin COMPU_METHOD CM_{index} "Linear {index}" RAT_FUNC "%8.3" "unit{index}"\n'
+            f"      COEFFS 0 1 {index % 5} 0 0 {factor}\n"
+            f"    /end COMPU_METHOD\n"
+        )
+
+
+def axis_limits(datatype):
+    return "0 255" if datatype == "UBYTE" else "-32768 32767" if datatype == "SWORD" else "0 65535"
+
+
+def generate_a2l(
+    a2l_path,
+    characteristics=1000,
+    std_axis_ratio=0.25,
+    axis_pts=100,
+    compu_method_count=50,
+    functions=50,
+    groups=50,
+    seed=0,
+):
+    """
+    Write a synthetic A2L and return the CHARACTERISTIC names in it.
+    std_axis_ratio is the share of CURVEs / MAPs with STD_AXIS instead of COM_AXIS axes.
+    """
+    rng = random.Random(seed)
+    names = []
+    function_members = [[] for _ in range(max(1, functions))]
+    group_members = [[] for _ in range(max(1, groups))]
+
+    with open(a2l_path, "w", encoding="utf-8", newline="\n") as a2l:
+        a2l.write('ASAP2_VERSION 1 61\n/begin PROJECT SYNTH "Synthetic benchmark project"\n')
+        a2l.write('  /begin MODULE SYNTH "Synthetic benchmark module"\n')
+        a2l.write(
+            '    /begin MOD_PAR ""\n'
+            f'      /begin MEMORY_SEGMENT _ROM "" DATA FLASH INTERN {hex(ROM_ADDRESS)} 0x40000000 -1 -1 -1 -1 -1\n'
+            "      /end MEMORY_SEGMENT\n"
+            "    /end MOD_PAR\n"
+        )
+        record_layouts(a2l)
+        compu_methods(a2l, max(1, compu_method_count))
+
+        # Shared axes, half of them X_POINTS long and half Y_POINTS long
+        address = AXIS_PTS_ADDRESS
+        axis_pool = {X_POINTS: [], Y_POINTS: []}
+        for index in range(max(2, axis_pts)):
+            points = X_POINTS if index % 2 == 0 else Y_POINTS
+            datatype = "UWORD" if index % 3 else "UBYTE"
+            conversion = f"CM_{rng.randrange(max(1, compu_method_count))}"
+            a2l.write(
+                f'    /begin AXIS_PTS AX_{index} "Shared axis {index}" {hex(address)} NO_INPUT_QUANTITY '
+                f"RL_AXIS_{datatype} 0 {conversion} {points} {axis_limits(datatype)}\n"
+                "    /end AXIS_PTS\n"
+            )
+            axis_pool[points].append(f"AX_{index}")
+            address += datatypes[datatype] * (points + 1)
+
+        address = CHARACTERISTIC_ADDRESS
+        for index in range(characteristics):
+            name = f"C_{index}"
+            datatype = rng.choice(list(datatypes))
+            size = datatypes[datatype]
+            conversion = (
+                "NO_COMPU_METHOD"
+                if datatype == "FLOAT32_IEEE"
+                else f"CM_{rng.randrange(max(1, compu_method_count))}"
+            )
+            kind = rng.choices(("VALUE", "CURVE", "MAP"), (1, 3, 6))[0]
+            dimensions = {"VALUE": (), "CURVE": (X_POINTS,), "MAP": (X_POINTS, Y_POINTS)}[kind]
+            std_axis = len(dimensions) > 0 and rng.random() < std_axis_ratio
+
+            if kind == "VALUE":
+                deposit = f"RL_VALUE_{datatype}"
+            elif std_axis:
+                deposit = f"RL_{'STD_CURVE' if kind == 'CURVE' else 'STD_MAP'}_{datatype}"
+            else:
+                deposit = f"RL_VALUE_{datatype}"
+
+            a2l.write(
+                f'    /begin CHARACTERISTIC {name} "Synthetic {kind.lower()} {index}" {kind} {hex(address)} '
+                f"{deposit} 0 {conversion} {axis_limits(datatype)}\n"
+            )
+            for axis_index, points in enumerate(dimensions):
+                axis_conversion = f"CM_{rng.randrange(max(1, compu_method_count))}"
+                if std_axis:
+                    a2l.write(
+                        f"      /begin AXIS_DESCR STD_AXIS NO_INPUT_QUANTITY {axis_conversion} {points} {axis_limits(datatype)}\n"
+                        "      /end AXIS_DESCR\n"
+                    )
+                else:
+                    a2l.write(
+                        f"      /begin AXIS_DESCR COM_AXIS NO_INPUT_QUANTITY {axis_conversion} {points} 0 65535\n"
+                        f"        AXIS_PTS_REF {rng.choice(axis_pool[points])}\n"
+                        "      /end AXIS_DESCR\n"
+                    )
+            a2l.write(f"      DISPLAY_IDENTIFIER {name}_display\n    /end CHARACTERISTIC\n")
+
+            map_size = size
+            for points in dimensions:
+                map_size *= points
+            if std_axis:
+                map_size += sum(size * (points + 1) for points in dimensions)
+            address += map_size
+
+            names.append(name)
+            function_members[rng.randrange(len(function_members))].append(name)
+            group_members[rng.randrange(len(group_members))].append(name)
+
+        for index, members in enumerate(function_members):
+            a2l.write(f'    /begin FUNCTION F_{index} "Synthetic function {index}"\n')
+            if len(members) > 0:
+                a2l.write(f"      /begin DEF_CHARACTERISTIC {' '.join(members)}\n      /end DEF_CHARACTERISTIC\n")
+            a2l.write("    /end FUNCTION\n")
+        a2l.write('    /begin FUNCTION F_ROOT "Synthetic parent function"\n')
+        a2l.write(
+            f"      /begin SUB_FUNCTION {' '.join(f'F_{index}' for index in range(len(function_members)))}\n"
+            "      /end SUB_FUNCTION\n    /end FUNCTION\n"
+        )
+
+        for index, members in enumerate(group_members):
+            a2l.write(f'    /begin GROUP G_{index} "Synthetic group {index}"\n')
+            if len(members) > 0:
+                a2l.write(f"      /begin REF_CHARACTERISTIC {' '.join(members)}\n      /end REF_CHARACTERISTIC\n")
+            a2l.write("    /end GROUP\n")
+        a2l.write('    /begin GROUP G_ROOT "Synthetic root group" ROOT\n')
+        a2l.write(
+            f"      /begin SUB_GROUP {' '.join(f'G_{index}' for index in range(len(group_members)))}\n"
+            "      /end SUB_GROUP\n    /end GROUP\n"
+        )
+
+        a2l.write("  /end MODULE\n/end PROJECT\n")
+    return names
+
+
+def generate_csv(csv_path, names, count=None, seed=0):
+    """Write a table CSV selecting count of the names (all of them by default), in A2L order."""
+    rng = random.Random(seed)
+    if count is not None and count < len(names):
+        names = [names[index] for index in sorted(rng.sample(range(len(names)), count))]
+    with open(csv_path, "w", encoding="utf-8", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["Category 1", "Category 2", "Category 3", "Table Name", "Custom Name"])
+        for index, name in enumerate(names):
+            writer.writerow([f"Category {index % 10}", f"Sub {index % 7}" if index % 2 else "", "", name, ""])
+
+
+if __name__ == "__main__":
+    names = generate_a2l(sys.argv[1], int(sys.argv[2]))
+    if len(sys.argv) > 3:
+        generate_csv(sys.argv[3], names)
@@ -0,0 +1,208 @@
+import math
+
+import numpy as np
+
+# Decoding map values out of bins with NumPy, for a2lbincompare.py and a2lextract.py, and
+# encoding them back in for a2lpatch.py.
+#
+# Cells of many maps are decoded at once: the byte offsets of every cell are computed as one
+# array, the bytes gathered from the memory mapped bin in a single indexing operation and
+# viewed as the map's datatype, then converted with each map's COMPU_METHOD. Maps are only
+# grouped by datatype, never looped over cell by cell.
+
+dtypes = {
+    "UBYTE": "u1",
+    "SBYTE": "i1",
+    "UWORD": "u2",
+    "SWORD": "i2",
+    "ULONG": "u4",
+    "SLONG": "i4",
+    "FLOAT32_IEEE": "f4",
+}
+
+# A2L BYTE_ORDER names, MSB_LAST is little endian. Bins are LSB first unless told otherwise,
+# like the XDFs the converters write (lsbfirst).
+byte_orders = {
+    "MSB_LAST": "<",
+    "MSB_FIRST": ">",
+}
+DEFAULT_BYTE_ORDER = "MSB_LAST"
+
+
+def cell_counts(tables):
+    return np.array([math.prod(table.dimensions) for table in tables], dtype=np.int64)
+
+
+def point_counts(axes):
+    return np.array([axis.length for axis in axes], dtype=np.int64)
+
+
+def linear_coefficients(tables):
+    """
+    Per map (or axis) (b, c, e, f) of a RAT_FUNC COMPU_METHOD that is linear (a and d are 0), for
+    physical = (f * raw - c) / (b - e * raw). Maps without one keep their raw values.
+    """
+    coefficients = np.tile(np.array([1.0, 0.0, 0.0, 1.0]), (len(tables), 1))
+    for index, table in enumerate(tables):
+        if table.coeffs is None:
+            continue
+        a, b, c, d, e, f = table.coeffs
+        if a == 0 and d == 0:
+            coefficients[index] = (b, c, e, f)
+    return coefficients
+
+
+def cell_map_index(counts):
+    """Index of the map each cell belongs to, and the position of each cell within its map."""
+    map_index = np.repeat(np.arange(len(counts)), counts)
+    first_cells = np.cumsum(counts) - counts
+    return map_index, np.arange(int(counts.sum())) - first_cells[map_index]
+
+
+def gather_cells(data, tables, offsets, map_index, cell_index, byte_order=DEFAULT_BYTE_ORDER):
+    """
+    Raw values of cell cell_index of map map_index as float64, offsets being the byte offsets of
+    the maps' values in data (the memory mapped bin). One gather per datatype.
+    """
+    raw_bytes = np.frombuffer(data, dtype=np.uint8)
+    values = np.empty(len(map_index), dtype=np.float64)
+    data_size_names, data_size_of_map = data_size_codes(tables)
+    data_size_of_cell = data_size_of_map[map_index]
+    for code, data_size in enumerate(data_size_names):
+        dtype = np.dtype(byte_orders[byte_order] + dtypes[data_size])
+        cells = np.flatnonzero(data_size_of_cell == code)
+        cell_offsets = offsets[map_index[cells]] + cell_index[cells] * dtype.itemsize
+        gathered = raw_bytes[cell_offsets[:, None] + np.arange(dtype.itemsize)]
+        # Bins hold NaN bit patterns in FLOAT32 maps too, they stay NaN
+        with np.errstate(invalid="ignore"):
+            values[cells] = gathered.view(dtype).reshape(-1)
+    return values
+
+
+def decode_cells(data, tables, offsets, counts, byte_order=DEFAULT_BYTE_ORDER):
+    """
+    Raw values of every cell of the maps, concatenated in map order as float64.
+    offsets are the byte offsets of the maps' values in data (the memory mapped bin).
+    """
+    map_index, cell_index = cell_map_index(counts)
+    return gather_cells(data, tables, offsets, map_index, cell_index, byte_order)
+
+
+def physical_values(raw, tables, counts):
+    """Apply each map's linear COMPU_METHOD to its raw cell values."""
+    map_index, _ = cell_map_index(counts)
+    return physical_cell_values(raw, tables, map_index)
+
+
+def physical_cell_values(raw, tables, map_index):
+    """physical_values() for cells of any maps, map_index giving each cell's map."""
+    b, c, e, f = linear_coefficients(tables)[map_index].T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (f * raw - c) / (b - e * raw)
+
+
+def data_size_codes(tables):
+    """The distinct datatypes of the maps, and the index into them of each map's datatype."""
+    data_size_names = list(dict.fromkeys(table.data_size for table in tables))
+    return data_size_names, np.array([data_size_names.index(table.data_size) for table in tables], dtype=np.int64)
+
+
+def decode_values(data, tables, offsets, counts, byte_order=DEFAULT_BYTE_ORDER):
+    """
+    Physical values of every cell of the maps, concatenated in map order. Works for axes
+    (AxisDefs with the offsets of their points and point_counts()) the same way.
+    """
+    return physical_values(decode_cells(data, tables, offsets, counts, byte_order), tables, counts)
+
+
+class CellDiff:
+    """
+    Decoded before / after values of maps, concatenated in map order (first_cells and counts
+    locate each map's cells), with per map statistics of the cells that changed.
+    """
+
+    def __init__(self, before, after, counts):
+        self.before = before
+        self.after = after
+        self.counts = counts
+        self.first_cells = np.cumsum(counts) - counts
+        map_index, _ = cell_map_index(counts)
+        delta = np.abs(after - before)
+        # NaN == NaN is False, so unchanged NaN cells are not counted
+        changed = (before != after) & ~(np.isnan(before) & np.isnan(after))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            relative = np.where(before != 0, delta / np.abs(before), np.where(changed, np.inf, 0.0))
+        delta = np.where(changed, delta, 0.0)
+        relative = np.where(changed, relative, 0.0)
+        self.changed = np.bincount(map_index[changed], minlength=len(counts))
+        self.max_delta = np.zeros(len(counts))
+        self.max_relative = np.zeros(len(counts))
+        has_cells = counts > 0
+        if has_cells.any():
+            self.max_delta[has_cells] = np.maximum.reduceat(delta, self.first_cells[has_cells])
+            self.max_relative[has_cells] = np.maximum.reduceat(relative, self.first_cells[has_cells])
+
+    def cells(self, index):
+        first = self.first_cells[index]
+        return self.before[first : first + self.counts[index]], self.after[first : first + self.counts[index]]
+
+
+def diff_cells(data1, tables1, offsets1, data2, tables2, offsets2, byte_order=DEFAULT_BYTE_ORDER):
+    """Decode the values of the same maps from two bins and compare them cell by cell."""
+    counts = cell_counts(tables1)
+    before = decode_values(data1, tables1, offsets1, counts, byte_order)
+    after = decode_values(data2, tables2, offsets2, counts, byte_order)
+    return CellDiff(before, after, counts)
+
+
+def save_grids(grids_path, names, diff):
+    """Write the before / after values as columns of an .npz, with each map's name, first cell and cell count."""
+    np.savez_compressed(
+        grids_path,
+        name=np.array(names),
+        first_cell=diff.first_cells,
+        cells=diff.counts,
+        before=diff.before,
+        after=diff.after,
+    )
+
+
+def raw_values(physical, tables, map_index):
+    """
+    Raw values for physical cell values, map_index giving each cell's map (or axis): clipped to
+    its limits, then through the inverse of its linear COMPU_METHOD,
+    raw = (b * physical + c) / (f + e * physical). Maps without a linear COMPU_METHOD take the
+    values as raw, as decode_values() gives them, and only those without any are clipped.
+    Returns the raw values and which of the cells were clipped.
+    """
+    lower = np.array([table.lower_limit for table in tables], dtype=np.float64)[map_index]
+    upper = np.array([table.upper_limit for table in tables], dtype=np.float64)[map_index]
+    clippable = np.array(
+        [table.coeffs is None or (table.coeffs[0] == 0 and table.coeffs[3] == 0) for table in tables], dtype=bool
+    )[map_index]
+    clipped_physical = np.where(clippable, np.clip(physical, lower, upper), physical)
+    b, c, e, f = linear_coefficients(tables)[map_index].T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        raw = (b * clipped_physical + c) / (f + e * clipped_physical)
+    return raw, clipped_physical != physical
+
+
+def encode_cells(data, tables, offsets, map_index, cell_index, raw, byte_order=DEFAULT_BYTE_ORDER):
+    """
+    Write raw values into data (a writable memory mapped bin) at cell cell_index of map
+    map_index, offsets being the byte offsets of the maps' values. Integers are rounded and
+    saturated to their datatype. One scattered write per datatype.
+    """
+    raw_bytes = np.frombuffer(data, dtype=np.uint8)
+    data_size_names, data_size_of_map = data_size_codes(tables)
+    data_size_of_cell = data_size_of_map[map_index]
+    for code, data_size in enumerate(data_size_names):
+        dtype = np.dtype(byte_orders[byte_order] + dtypes[data_size])
+        cells = np.flatnonzero(data_size_of_cell == code)
+        values = raw[cells]
+        if dtype.kind in "iu":
+            values = np.clip(np.rint(values), np.iinfo(dtype).min, np.iinfo(dtype).max)
+        cell_offsets = offsets[map_index[cells]] + cell_index[cells] * dtype.itemsize
+        raw_bytes[cell_offsets[:, None] + np.arange(dtype.itemsize)] = (
+            values.astype(dtype).view(np.uint8).reshape(-1, dtype.itemsize)
+        )
@@ -0,0 +1,77 @@
+import hashlib
+import marshal
+import os
+
+from a2lcache import cache_dir
+from a2lcommon import write_atomic
+from a2lprofile import stage
+
+# Output fragments of the previous run, for incremental regeneration.
+#
+# Every table an emitter builds is serialized into a fragment (the bytes one flush() writes).
+# Fragments are keyed by everything they are built from: the resolved table definition, the
+# CSV row (categories, custom name), the emitter variant, and whatever earlier rows decide
+# (category indices, whether an axis table is first emitted here). A rerun after a few CSV
+# rows changed only builds those tables again and copies the rest from the previous run.
+#
+# A2L_INCREMENTAL  set to 0 to rebuild every table instead of reusing the previous fragments
+
+FRAGMENTS_VERSION = 1
+
+
+def incremental():
+    return os.environ.get("A2L_INCREMENTAL", "1") != "0"
+
+
+def fragment_key(*parts):
+    return hashlib.sha256(repr((FRAGMENTS_VERSION,) + parts).encode("utf-8")).digest()
+
+
+def fragment_cache_path(output_path):
+    directory = cache_dir()
+    os.makedirs(directory, exist_ok=True)
+    output_key = hashlib.sha256(os.path.abspath(output_path).encode("utf-8")).hexdigest()
+    return os.path.join(directory, f"{output_key}.fragments")
+
+
+class FragmentCache:
+    """
+    The fragments of one output file. Fragments used (or built) by this run replace the
+    previous ones on save(), so tables dropped from the CSV are dropped from the cache too.
+    """
+
+    def __init__(self, cache_path, previous=None):
+        self.cache_path = cache_path
+        self.previous = previous or {}
+        self.current = {}
+        self.hits = 0
+
+    def get(self, key):
+        fragment = self.previous.get(key)
+        if fragment is not None:
+            self.hits += 1
+        return fragment
+
+    def add(self, key, fragment):
+        self.current[key] = fragment
+
+    def save(self):
+        if self.current == self.previous:
+            return
+        with stage("fragments.save"):
+            write_atomic(self.cache_path, marshal.dumps((FRAGMENTS_VERSION, self.current)), prefix=".fragments-")
+
+    @classmethod
+    def load(cls, output_path):
+        cache_path = fragment_cache_path(output_path)
+        if not incremental() or not os.path.exists(cache_path):
+            return cls(cache_path)
+        with stage("fragments.load"):
+            with open(cache_path, "rb") as cache_file:
+                try:
+                    version, previous = marshal.loads(cache_file.read())
+                except (EOFError, ValueError, TypeError):
+                    return cls(cache_path)
+        if version != FRAGMENTS_VERSION:
+            return cls(cache_path)
+        return cls(cache_path, previous)
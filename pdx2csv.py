@@ -1,52 +1,327 @@
 import csv
-from pathlib import Path
+import fnmatch
+import os
+import zipfile
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path, PurePosixPath
 from sys import argv
 import xml.etree.ElementTree as ET
-from xml.etree.ElementTree import Element
+from xml.etree.ElementTree import Element, SubElement
 
-ecm_odx = list(Path(argv[1]).glob("EV_*"))[0].read_text(encoding='utf8')
-ecm_layer = ET.fromstring(ecm_odx)
+from a2lcommon import output_names, take_options
 
-controlmodule_file = list(Path(argv[1]).glob("BL_LIBEnginContrModulUDS_*.odx"))
-if len(controlmodule_file) > 0:
-    controlmoduleuds_odx = list(Path(argv[1]).glob("BL_LIBEnginContrModulUDS_*.odx"))[0].read_text(encoding='utf8')
-else:
-    controlmoduleuds_odx = list(Path(argv[1]).glob("BV_Engin*.odx"))[0].read_text(encoding='utf8')
+# CLI arguments: pdx2csv.py [pdx file or directory] [--stream] [--workers N]
+#
+# The PDX is read straight from the .pdx archive, nothing is extracted to disk. A directory
+# the PDX was unzipped to works too.
+#
+# --stream parses the ODX layers with iterparse, keeping only the elements pdx2csv reads and
+# dropping everything else as it goes, for PDX bundles too big to hold as whole trees.
+#
+# --workers N parses the ECU variant, the base layer and the layers they DOCREF on N processes
+# (--workers alone uses every CPU).
+#
+# Batch mode: pdx2csv.py --batch [output directory] [pdx file or directory...] [--stream] [--workers N]
+#
+# Extracts every EV_ variant of every PDX given (directories holding .pdx files are expanded)
+# into [output directory]/[bundle]/[variant]/dtc.csv and diag.csv, plus dtc_catalogue.csv and
+# did_catalogue.csv with the distinct DTCs and identifiers and the variants that have them.
+# Identical layers, like a base layer shared by a bundle's variants, are only parsed once. Each
+# bundle's layers are parsed on --workers processes (every CPU by default) just before its
+# variants are written, and dropped with its archive once no bundle still to write has them.
 
-control_module_layer = ET.fromstring(controlmoduleuds_odx)
+# The elements pdx2csv reads, with their subtrees
+KEPT_TAGS = ("DTC", "TABLE-ROW", "STRUCTURE", "DATA-OBJECT-PROP", "UNIT")
+# Elements looked up by ID in table_row_to_conversion, DATA-OBJECT-PROPs also by SHORT-NAME for DOP-SNREF
+INDEXED_TAGS = ("STRUCTURE", "DATA-OBJECT-PROP", "UNIT")
+# TABLEs whose TABLE-ROWs are kept
+KEPT_TABLES = ("TAB_RecorDataIdentMeasuValue",)
+# Text table DATA-OBJECT-PROPs only kept as their (LOWER-LIMIT, VT) scales
+KEPT_TEXT_TABLES = ("DOP_TEXTTABLERecorDataIdentMeasuValue",)
 
-layers = [control_module_layer, ecm_layer]
+DTC_FIELDS = ["code", "pcode", "name", "symbol"]
+DID_FIELDS = ["identifier", "name", "unit", "description", "type", "bytes", "equation"]
 
-layers_by_name = {}
+# Parsed layers by PdxBundle.member_key(), shared by every bundle with the same member
+parsed_layers = {}
 
-def load_layer_by_name(layer_name):
-    if layer_name in layers_by_name:
-        return layers_by_name[layer_name]
-    filepath = list(Path(argv[1]).glob(layer_name + "*.odx"))[0]
-    layers_by_name[layer_name] = ET.fromstring(filepath.read_text(encoding='utf-8'))
-    return layers_by_name[layer_name]
 
-def layer_ref(layer, element):
+def first_text(element: Element, path):
+    found = element.find(path)
+    return found.text if found is not None else None
+
+
+class OdxLayer:
+    """
+    What pdx2csv reads of an ODX layer: DTCs and the scales of KEPT_TEXT_TABLES as plain
+    records, the TABLE-ROWs of KEPT_TABLES, and the STRUCTUREs, DATA-OBJECT-PROPs and UNITs
+    indexed once, instead of a full .//TAG[@ID=...] search for every lookup.
+    """
+
+    def __init__(self):
+        self.dtcs = []
+        self.text_tables = {}
+        self.table_rows = {}
+        self.by_id = {}
+        self.by_short_name = {}
+        # The indexed elements in document order
+        self.kept = []
+        # Layers the kept elements reference by DOCREF, which are parsed ahead when preloading
+        self.docrefs = set()
+
+    def add(self, element: Element):
+        if element.tag == "DTC":
+            self.dtcs.append(
+                {
+                    'code': first_text(element, "TROUBLE-CODE"),
+                    'pcode': first_text(element, "DISPLAY-TROUBLE-CODE"),
+                    'name': first_text(element, "TEXT"),
+                    'symbol': element.get("OID")
+                }
+            )
+            return
+        if element.tag == "DATA-OBJECT-PROP" and element.get("ID") in KEPT_TEXT_TABLES:
+            self.text_tables.setdefault(element.get("ID"), []).extend(
+                (first_text(scale, ".//LOWER-LIMIT"), first_text(scale, ".//VT"))
+                for scale in element.iterfind(".//COMPU-SCALE")
+            )
+            return
+        self.add_docrefs(element)
+        self.kept.append(element)
+        # The first match wins, like find() in document order
+        element_id = element.get("ID")
+        if element_id is not None:
+            self.by_id.setdefault((element.tag, element_id), element)
+        short_name = element.findtext("SHORT-NAME")
+        if short_name is not None:
+            self.by_short_name.setdefault((element.tag, short_name), element)
+
+    def add_table_row(self, table_id, table_row: Element):
+        self.table_rows.setdefault(table_id, []).append(table_row)
+        self.add_docrefs(table_row)
+
+    def add_docrefs(self, element: Element):
+        for child in element.iter():
+            docref = child.get("DOCREF")
+            if docref:
+                self.docrefs.add(docref)
+
+    def find_id(self, tag, element_id):
+        return self.by_id.get((tag, element_id))
+
+    def find_short_name(self, tag, short_name):
+        return self.by_short_name.get((tag, short_name))
+
+    def __getstate__(self):
+        # Elements pickle several times slower than they parse, so layers parsed in worker
+        # processes send their kept elements back as XML
+        kept = Element("KEPT")
+        kept.extend(self.kept)
+        tables = Element("TABLES")
+        for table_id, table_rows in self.table_rows.items():
+            table = SubElement(tables, "TABLE", ID=table_id)
+            table.extend(table_rows)
+        return {
+            "dtcs": self.dtcs,
+            "text_tables": self.text_tables,
+            "docrefs": self.docrefs,
+            "kept": ET.tostring(kept),
+            "tables": ET.tostring(tables),
+        }
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.dtcs = state["dtcs"]
+        self.text_tables = state["text_tables"]
+        for element in ET.fromstring(state["kept"]):
+            self.add(element)
+        for table in ET.fromstring(state["tables"]):
+            for table_row in table:
+                self.add_table_row(table.get("ID"), table_row)
+        self.docrefs = state["docrefs"]
+
+    @classmethod
+    def parse(cls, odx_file):
+        layer = cls()
+        root = ET.fromstring(odx_file.read().decode("utf-8"))
+        for element in root.iter():
+            if element.tag in KEPT_TAGS and element.tag != "TABLE-ROW":
+                layer.add(element)
+        for table in root.iter("TABLE"):
+            if table.get("ID") in KEPT_TABLES:
+                for table_row in table.iterfind("TABLE-ROW"):
+                    layer.add_table_row(table.get("ID"), table_row)
+        return layer
+
+    @classmethod
+    def stream(cls, odx_file):
+        layer = cls()
+        open_elements = []
+        # Open KEPT_TAGS elements, nothing is dropped inside them
+        kept_depth = 0
+        for event, element in ET.iterparse(odx_file, events=("start", "end")):
+            if event == "start":
+                open_elements.append(element)
+                if element.tag in KEPT_TAGS:
+                    kept_depth += 1
+                continue
+            open_elements.pop()
+            if element.tag in KEPT_TAGS:
+                kept_depth -= 1
+                if element.tag != "TABLE-ROW":
+                    layer.add(element)
+                elif len(open_elements) > 0 and open_elements[-1].tag == "TABLE" and open_elements[-1].get("ID") in KEPT_TABLES:
+                    layer.add_table_row(open_elements[-1].get("ID"), element)
+            if kept_depth == 0 and len(open_elements) > 0:
+                # A finished element is always the last child of its parent so far
+                del open_elements[-1][-1]
+        return layer
+
+
+class PdxBundle:
+    """
+    A .pdx archive, or a directory a PDX was unzipped to. Members are indexed by file name
+    once, and every ODX layer is parsed once, on first use or ahead of time by preload_layers().
+    """
+
+    def __init__(self, pdx_path, stream=False):
+        self.pdx_path = Path(pdx_path)
+        self.stream = stream
+        self.archive = None
+        self.members = {}
+        if self.pdx_path.is_dir():
+            for member in self.pdx_path.iterdir():
+                if member.is_file():
+                    self.members[member.name] = member
+        else:
+            self.archive = zipfile.ZipFile(self.pdx_path)
+            for info in self.archive.infolist():
+                if not info.is_dir():
+                    self.members.setdefault(PurePosixPath(info.filename).name, info)
+        self.names = sorted(self.members)
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+
+    def find(self, pattern):
+        """Member names matching a glob pattern, like Path.glob() on the unzipped directory."""
+        return [name for name in self.names if fnmatch.fnmatch(name, pattern)]
+
+    def open(self, name):
+        if self.archive is not None:
+            return self.archive.open(self.members[name])
+        return open(self.members[name], "rb")
+
+    def parse(self, name):
+        with self.open(name) as odx_file:
+            if self.stream:
+                return OdxLayer.stream(odx_file)
+            return OdxLayer.parse(odx_file)
+
+    def member_key(self, name):
+        """
+        Identifies a member's content: archive members by name, CRC and size, so the same
+        layer shipped in several bundles is parsed once. Files in directories by their path.
+        """
+        if self.archive is not None:
+            info = self.members[name]
+            return (name, info.CRC, info.file_size, self.stream)
+        return (str(self.members[name].resolve()), self.stream)
+
+    def layer(self, name):
+        key = self.member_key(name)
+        if key not in parsed_layers:
+            parsed_layers[key] = self.parse(name)
+        return parsed_layers[key]
+
+    def docref_member(self, layer_name):
+        members = self.find(layer_name + "*.odx")
+        return members[0] if len(members) > 0 else None
+
+    def layer_by_name(self, layer_name):
+        return self.layer(self.find(layer_name + "*.odx")[0])
+
+
+# Bundles opened by this worker process, so each archive is indexed once per worker
+worker_bundles = {}
+
+
+def parse_member(pdx_path, stream, name):
+    if (pdx_path, stream) not in worker_bundles:
+        worker_bundles[(pdx_path, stream)] = PdxBundle(pdx_path, stream)
+    return worker_bundles[(pdx_path, stream)].parse(name)
+
+
+def preload_layers(members, workers):
+    """
+    Parse (bundle, member name) layers on a pool of workers, along with every layer their kept
+    elements DOCREF, submitted as soon as the referencing layer is parsed. DOCREFs without a
+    matching member are left for layer_by_name() to fail on if they are ever followed.
+    """
+    # Futures -> the (bundle, member name)s waiting for them, and member keys -> futures
+    pending = {}
+    submitted = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while len(members) > 0 or len(pending) > 0:
+            for bundle, name in members:
+                key = bundle.member_key(name)
+                if key in parsed_layers:
+                    continue
+                if key not in submitted:
+                    submitted[key] = executor.submit(parse_member, bundle.pdx_path, bundle.stream, name)
+                    pending[submitted[key]] = []
+                pending[submitted[key]].append((bundle, name))
+            members = []
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                layer = future.result()
+                for bundle, name in pending.pop(future):
+                    parsed_layers[bundle.member_key(name)] = layer
+                    for docref in sorted(layer.docrefs):
+                        member = bundle.docref_member(docref)
+                        if member is not None:
+                            members.append((bundle, member))
+
+
+def layer_ref(bundle, layer, element):
     doc_name = element.get("DOCREF")
     if doc_name:
-        layer = load_layer_by_name(doc_name)
+        layer = bundle.layer_by_name(doc_name)
     return layer
 
-def table_row_to_conversion(layer: Element, table_row: Element):
+def table_rows_by_key(layers, table_id):
+    """
+    KEY -> (layer, TABLE-ROW) for the rows of every TABLE with table_id, collected once.
+    Earlier layers take precedence, and the first row with a key within a layer.
+    """
+    rows_by_key = {}
+    for layer in layers:
+        for table_row in layer.table_rows.get(table_id, []):
+            for key in table_row.iterfind("KEY"):
+                rows_by_key.setdefault("".join(key.itertext()), (layer, table_row))
+    return rows_by_key
+
+
+def table_row_to_conversion(bundle: PdxBundle, layer: OdxLayer, table_row: Element):
     structure_ref = table_row.find("STRUCTURE-REF")
     structure_id = structure_ref.get("ID-REF")
-    layer = layer_ref(layer, structure_ref)
-    structure = layer.find(f".//STRUCTURE[@ID='{structure_id}']")
+    layer = layer_ref(bundle, layer, structure_ref)
+    structure = layer.find_id("STRUCTURE", structure_id)
     dop_ref = structure.find('.//PARAM/DOP-REF')
     if dop_ref is None:
         dop_ref = structure.find('.//PARAM/DOP-SNREF')
         dop_shortname = dop_ref.get("SHORT-NAME")
-        layer = layer_ref(layer, dop_ref)
-        data_format = layer.find(f".//DATA-OBJECT-PROP[@ID='{dop_shortname}']")
+        layer = layer_ref(bundle, layer, dop_ref)
+        # Some layers give their DATA-OBJECT-PROPs the SHORT-NAME as ID, look that up first
+        data_format = layer.find_id("DATA-OBJECT-PROP", dop_shortname)
+        if data_format is None:
+            data_format = layer.find_short_name("DATA-OBJECT-PROP", dop_shortname)
     else: 
         dop_id = dop_ref.get("ID-REF")
-        layer = layer_ref(layer, dop_ref)
-        data_format = layer.find(f".//DATA-OBJECT-PROP[@ID='{dop_id}']")
+        layer = layer_ref(bundle, layer, dop_ref)
+        data_format = layer.find_id("DATA-OBJECT-PROP", dop_id)
     equation = ""
     byte_length = 0
     diag_type = ""
@@ -55,8 +330,8 @@ def table_row_to_conversion(layer: Element, table_row: Element):
         unit_ref = data_format.find("UNIT-REF")
         if unit_ref is not None:
             unit_id = unit_ref.get("ID-REF")
-            layer = layer_ref(layer, unit_ref)
-            unit = layer.find(f".//UNIT[@ID='{unit_id}']")
+            layer = layer_ref(bundle, layer, unit_ref)
+            unit = layer.find_id("UNIT", unit_id)
             unit_display_name = unit.find("DISPLAY-NAME").text
         diag_type = data_format.find("DIAG-CODED-TYPE").get("BASE-DATA-TYPE")
         byte_length_val = data_format.find("DIAG-CODED-TYPE/BIT-LENGTH")
@@ -68,44 +343,23 @@ def table_row_to_conversion(layer: Element, table_row: Element):
             equation = f"( {numer_factors[1].text} * X + {numer_factors[0].text} ) / {denom_factors[0].text}"
     return (diag_type, byte_length, equation, unit_display_name)
 
-dtcs = []
-
-for dtc in ecm_layer.findall(".//DTC"):
-    dtc_code = dtc.find("TROUBLE-CODE").text
-    dtc_pcode = dtc.find("DISPLAY-TROUBLE-CODE").text
-    dtc_name = dtc.find("TEXT").text
-    dtc_symbol = dtc.get("OID")
-    dtcs.append(
-        {
-            'code': dtc_code,
-            'pcode': dtc_pcode,
-            'name': dtc_name,
-            'symbol': dtc_symbol
-        }
-    )
-
-diag_info = []
-
-
-with open("dtc.csv", "w", newline="") as csvfile:
-    fieldnames = [
-        "code", "pcode", "name", "symbol"
-    ]
-    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-    writer.writeheader()
-    for info in dtcs:
-        writer.writerow(info)   
-
-for ident_table in ecm_layer.findall(".//DATA-OBJECT-PROP[@ID='DOP_TEXTTABLERecorDataIdentMeasuValue']"):
-    for measurement_value in ident_table.findall(".//COMPU-SCALE"):
-        identifier = int(measurement_value.find(".//LOWER-LIMIT").text).to_bytes(2, 'big').hex()
-        key = measurement_value.find(".//VT").text
-        for layer in layers:
-            table_row_ref = layer.find(f".//TABLE[@ID='TAB_RecorDataIdentMeasuValue']/TABLE-ROW/KEY[. = '{key}']/..")
-            if table_row_ref is not None:
-                row_layer = layer
-                break
+
+def control_module_member(bundle):
+    controlmodule_file = bundle.find("BL_LIBEnginContrModulUDS_*.odx")
+    if len(controlmodule_file) > 0:
+        return controlmodule_file[0]
+    return bundle.find("BV_Engin*.odx")[0]
+
+
+def diag_identifiers(bundle, layers, ecm_layer):
+    """The $22 identifiers of an ECU variant, looked up in its layers (the base layer first)."""
+    diag_info = []
+
+    ident_rows = table_rows_by_key(layers, "TAB_RecorDataIdentMeasuValue")
+
+    for lower_limit, key in ecm_layer.text_tables.get("DOP_TEXTTABLERecorDataIdentMeasuValue", []):
+        identifier = int(lower_limit).to_bytes(2, 'big').hex()
+        row_layer, table_row_ref = ident_rows.get(key, (None, None))
         if table_row_ref:
             name = table_row_ref.find("LONG-NAME").text
             description = table_row_ref.find("DESC")
@@ -113,7 +367,7 @@ for ident_table in ecm_layer.findall(".//DATA-OBJECT-PROP[@ID='DOP_TEXTTABLEReco
                 description_text = ''.join(description.itertext()).replace("\n","").strip()
             else:
                 description_text = name
-            (diag_type, byte_length, equation, unit_display_name) = table_row_to_conversion(row_layer, table_row_ref)
+            (diag_type, byte_length, equation, unit_display_name) = table_row_to_conversion(bundle, row_layer, table_row_ref)
             diag_info.append(
                 {
                     'identifier': identifier,
@@ -139,13 +393,115 @@ for ident_table in ecm_layer.findall(".//DATA-OBJECT-PROP[@ID='DOP_TEXTTABLEReco
                     'equation': ""
                 }
             )
+    return diag_info
+
+
+def write_csv(csv_path, fieldnames, rows):
+    with open(csv_path, "w", newline="") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+
+        writer.writeheader()
+        for info in rows:
+            writer.writerow(info)
+
+
+def library_bundles(pdx_paths):
+    """PDX files and unzipped PDX directories to batch, directories without .odx files expanded to their .pdx files."""
+    bundles = []
+    for pdx_path in pdx_paths:
+        pdx_path = Path(pdx_path)
+        if pdx_path.is_dir() and len(list(pdx_path.glob("*.odx"))) == 0:
+            bundles.extend(sorted(pdx_path.glob("*.pdx")))
+        else:
+            bundles.append(pdx_path)
+    return bundles
+
+
+def add_to_catalogue(catalogue, fieldnames, rows, variant):
+    """Merge a variant's rows into a catalogue of distinct rows, each listing the variants that have it."""
+    for row in rows:
+        key = tuple(row[field] for field in fieldnames)
+        catalogue.setdefault(key, dict(row, variants=[]))["variants"].append(variant)
+
+
+def write_catalogue(csv_path, fieldnames, catalogue):
+    rows = [dict(row, variants=";".join(row["variants"])) for row in catalogue.values()]
+    # Sorted by code / identifier, differing definitions of one stay in the order they were found
+    rows.sort(key=lambda row: str(row[fieldnames[0]]))
+    write_csv(csv_path, fieldnames + ["variants"], rows)
+
+
+def batch(output_dir, pdx_paths, stream, workers):
+    bundles = []
+    for pdx_path in library_bundles(pdx_paths):
+        bundle = PdxBundle(pdx_path, stream)
+        if len(bundle.find("EV_*")) == 0:
+            print(f"Skipping {pdx_path}: no EV_ variant")
+            bundle.close()
+            continue
+        if len(bundle.find("BL_LIBEnginContrModulUDS_*.odx")) == 0 and len(bundle.find("BV_Engin*.odx")) == 0:
+            print(f"Skipping {pdx_path}: no BL_LIBEnginContrModulUDS_ or BV_Engin base layer")
+            bundle.close()
+            continue
+        bundles.append(bundle)
+
+    # Number of bundles still to write that have each member, a layer is dropped once none has it
+    key_counts = Counter(bundle.member_key(name) for bundle in bundles for name in bundle.names)
+    dtc_catalogue = {}
+    did_catalogue = {}
+    for bundle, bundle_name in zip(bundles, output_names([bundle.pdx_path for bundle in bundles])):
+        if workers > 1:
+            members = [(bundle, control_module_member(bundle))]
+            members.extend((bundle, ecm_member) for ecm_member in bundle.find("EV_*"))
+            preload_layers(members, workers)
+        control_module_layer = bundle.layer(control_module_member(bundle))
+        for ecm_member in bundle.find("EV_*"):
+            ecm_layer = bundle.layer(ecm_member)
+            variant = f"{bundle_name}/{Path(ecm_member).stem}"
+            variant_dir = Path(output_dir) / variant
+            variant_dir.mkdir(parents=True, exist_ok=True)
+            diag_info = diag_identifiers(bundle, [control_module_layer, ecm_layer], ecm_layer)
+            write_csv(variant_dir / "dtc.csv", DTC_FIELDS, ecm_layer.dtcs)
+            write_csv(variant_dir / "diag.csv", DID_FIELDS, diag_info)
+            add_to_catalogue(dtc_catalogue, DTC_FIELDS, ecm_layer.dtcs, variant)
+            add_to_catalogue(did_catalogue, DID_FIELDS, diag_info, variant)
+            print(f"{variant}: {len(ecm_layer.dtcs)} DTCs, {len(diag_info)} identifiers")
+        for name in bundle.names:
+            key = bundle.member_key(name)
+            key_counts[key] -= 1
+            if key_counts[key] == 0:
+                parsed_layers.pop(key, None)
+        bundle.close()
+
+    write_catalogue(Path(output_dir) / "dtc_catalogue.csv", DTC_FIELDS, dtc_catalogue)
+    write_catalogue(Path(output_dir) / "did_catalogue.csv", DID_FIELDS, did_catalogue)
+    print(f"{len(dtc_catalogue)} distinct DTCs and {len(did_catalogue)} distinct identifiers in {output_dir}")
+
+
+def main(argv):
+    argv, options = take_options(argv, ("--batch",), flags=("--stream",), counts=("--workers",))
+    # Batch mode runs on every CPU unless told otherwise, a single PDX is parsed serially
+    workers = os.cpu_count() if "--batch" in options else 1
+    if "--workers" in options:
+        workers = int(options["--workers"]) if options["--workers"] else os.cpu_count()
+
+    if "--batch" in options:
+        batch(options["--batch"], argv[1:], "--stream" in options, workers)
+        return
+
+    bundle = PdxBundle(argv[1], "--stream" in options)
+    ecm_member = bundle.find("EV_*")[0]
+    control_module = control_module_member(bundle)
+    if workers > 1:
+        preload_layers([(bundle, ecm_member), (bundle, control_module)], workers)
+
+    ecm_layer = bundle.layer(ecm_member)
+    control_module_layer = bundle.layer(control_module)
+    layers = [control_module_layer, ecm_layer]
+
+    write_csv("dtc.csv", DTC_FIELDS, ecm_layer.dtcs)
+    write_csv("diag.csv", DID_FIELDS, diag_identifiers(bundle, layers, ecm_layer))
 
-with open("diag.csv", "w", newline="") as csvfile:
-    fieldnames = [
-        "identifier","name","unit","description","type","bytes","equation"
-    ]
-    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
 
-    writer.writeheader()
-    for info in diag_info:
-        writer.writerow(info)   
\ No newline at end of file
+if __name__ == "__main__":
+    main(argv)
@@ -0,0 +1,250 @@
+import marshal
+import os
+
+from a2lcommon import write_atomic
+from a2lprofile import stage
+
+# Pre-resolved table definitions.
+#
+# A TableDef holds everything the XDF and XML emitters need to know about one
+# characteristic (addresses are raw ECU addresses, each emitter applies its own offset).
+# Table definitions for an A2L are kept in a snapshot next to its cached db, so later
+# conversions of the same A2L can run without importing pya2l or SQLAlchemy at all.
+
+# Bump whenever the records, what a snapshot holds or how a2lresolve.py resolves them changes,
+# snapshots of another version are resolved again from scratch.
+# 2: "Characteristic" memberships, STD_AXIS sizes from each characteristic's AXIS_DESCR
+SNAPSHOT_VERSION = 2
+
+
+class AxisDef:
+    """
+    kind is COM_AXIS (shared AXIS_PTS), STD_AXIS (stored in front of the map) or FIX_AXIS.
+    address is the address of the axis' point count, the points start count_size bytes later.
+    """
+
+    __slots__ = (
+        "kind",
+        "name",
+        "units",
+        "lower_limit",
+        "upper_limit",
+        "address",
+        "count_size",
+        "length",
+        "data_size",
+        "coeffs",
+        "conversion_type",
+        "values",
+    )
+
+    def __init__(
+        self,
+        kind,
+        name,
+        units,
+        lower_limit,
+        upper_limit,
+        address,
+        count_size,
+        length,
+        data_size,
+        coeffs,
+        conversion_type,
+        values,
+    ):
+        self.kind = kind
+        self.name = name
+        self.units = units
+        self.lower_limit = lower_limit
+        self.upper_limit = upper_limit
+        self.address = address
+        self.count_size = count_size
+        self.length = length
+        self.data_size = data_size
+        self.coeffs = coeffs
+        self.conversion_type = conversion_type
+        self.values = values
+
+    def to_tuple(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+
+def axis_points_address(axis, dsg=False):
+    """
+    Address of an axis' first point. STD_AXIS and COM_AXIS data start with the point count,
+    except COM_AXIS data in DSG (DQ250) layouts, which only holds the points.
+    """
+    if axis.kind == "STD_AXIS" or not dsg:
+        return axis.address + axis.count_size
+    return axis.address
+
+
+class TableDef:
+    """
+    address is the address of the map values (after any STD_AXIS data in front of them).
+    axes holds the first two AXIS_DESCRs, None where the axis type is not supported.
+    dimensions holds maxAxisPoints for every AXIS_DESCR.
+    """
+
+    __slots__ = (
+        "name",
+        "long_identifier",
+        "display_identifier",
+        "address",
+        "data_size",
+        "lower_limit",
+        "upper_limit",
+        "units",
+        "coeffs",
+        "conversion_type",
+        "dimensions",
+        "axes",
+    )
+
+    def __init__(
+        self,
+        name,
+        long_identifier,
+        display_identifier,
+        address,
+        data_size,
+        lower_limit,
+        upper_limit,
+        units,
+        coeffs,
+        conversion_type,
+        dimensions,
+        axes,
+    ):
+        self.name = name
+        self.long_identifier = long_identifier
+        self.display_identifier = display_identifier
+        self.address = address
+        self.data_size = data_size
+        self.lower_limit = lower_limit
+        self.upper_limit = upper_limit
+        self.units = units
+        self.coeffs = coeffs
+        self.conversion_type = conversion_type
+        self.dimensions = dimensions
+        self.axes = axes
+
+    def to_tuple(self):
+        values = [getattr(self, field) for field in self.__slots__]
+        values[-1] = tuple(axis.to_tuple() if axis else None for axis in self.axes)
+        return tuple(values)
+
+    @classmethod
+    def from_tuple(cls, values):
+        axes = tuple(AxisDef(*axis) if axis else None for axis in values[-1])
+        return cls(*values[:-1], axes)
+
+
+class TableDefSnapshot:
+    """
+    Resolved tables of one A2L, stored as plain tuples and only turned into TableDefs on use.
+
+    segments     MEMORY_SEGMENT name -> address
+    missing      names that are not characteristics in the A2L
+    axis_pts     names that are AXIS_PTS rather than characteristics
+    memberships  "Function" / "Group" -> [(name, [table names])], for ALL mode
+                 "Characteristic" -> [(name, [name])] for every characteristic
+    """
+
+    def __init__(self):
+        self.segments = {}
+        self.tables = {}
+        self.missing = set()
+        self.axis_pts = set()
+        self.memberships = {}
+        self.changed = False
+
+    def __contains__(self, name):
+        return name in self.tables
+
+    def get(self, name):
+        values = self.tables.get(name)
+        return TableDef.from_tuple(values) if values is not None else None
+
+    def add(self, table):
+        self.tables[table.name] = table.to_tuple()
+        self.changed = True
+
+    def unresolved(self, names):
+        return [
+            name
+            for name in dict.fromkeys(names)
+            if name not in self.tables and name not in self.missing and name not in self.axis_pts
+        ]
+
+    def save(self, snapshot_path):
+        data = marshal.dumps(
+            (
+                SNAPSHOT_VERSION,
+                self.segments,
+                self.tables,
+                sorted(self.missing),
+                sorted(self.axis_pts),
+                self.memberships,
+            )
+        )
+        write_atomic(snapshot_path, data, prefix=".snapshot-")
+        self.changed = False
+
+    @classmethod
+    def load(cls, snapshot_path):
+        snapshot = cls()
+        if not os.path.exists(snapshot_path):
+            return snapshot
+        with open(snapshot_path, "rb") as snapshot_file:
+            try:
+                data = marshal.loads(snapshot_file.read())
+            except (EOFError, ValueError, TypeError):
+                return snapshot
+        if data[0] != SNAPSHOT_VERSION:
+            return snapshot
+        _, snapshot.segments, snapshot.tables, missing, axis_pts, snapshot.memberships = data
+        snapshot.missing = set(missing)
+        snapshot.axis_pts = set(axis_pts)
+        return snapshot
+
+
+def snapshot_path(cache_key):
+    # Imported here so this module stays importable without pya2l
+    from a2lcache import cache_dir
+
+    directory = cache_dir()
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{cache_key}.tabledefs")
+
+
+def load_table_defs(a2l_path, names=(), memberships=(), workers=1, keep=()):
+    """
+    Load the table snapshot for an A2L, resolving any of names (and the "Function" / "Group"
+    membership lists for ALL mode) it does not know yet. pya2l is only imported when something
+    has to be resolved, membership lists are resolved on a process pool when workers > 1.
+    keep names cache files that opening the A2L must not evict.
+    """
+    from a2lcache import a2l_cache_key
+
+    # Hashed once here, the A2L is opened (in every resolve worker too) with this key
+    with stage("a2l.hash"):
+        cache_key = a2l_cache_key(a2l_path)
+    path = snapshot_path(cache_key)
+    with stage("snapshot.load"):
+        snapshot = TableDefSnapshot.load(path)
+    unresolved = snapshot.unresolved(names)
+    if (
+        len(snapshot.segments) == 0
+        or len(unresolved) > 0
+        or any(membership not in snapshot.memberships for membership in memberships)
+    ):
+        with stage("resolve.modules"):
+            from a2lresolve import complete_snapshot
+
+        complete_snapshot(snapshot, a2l_path, cache_key, unresolved, memberships, workers, keep)
+    if snapshot.changed:
+        with stage("snapshot.save"):
+            snapshot.save(path)
+    return snapshot
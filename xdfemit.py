@@ -0,0 +1,462 @@
+from xml.etree.ElementTree import Element, SubElement
+
+from a2lcommon import AddressRanges, AxisIndex, CategoryRegistry, calc_map_size, data_sizes
+from fragments import FragmentCache, fragment_key
+from tabledefs import AxisDef, TableDef, axis_points_address
+from xmlstream import StreamingXmlWriter, serialize_elements
+
+# TunerPro XDF output, shared by a2l2xdf.py, a2l2xdf-dsg.py and a2lconvert.py
+#
+# The DSG flavour differs from the ECU one in its header (no base offset, smaller region),
+# how addresses are mapped into the bin, the z data type flags, which name is used as the
+# table description and how ALL mode groups tables (A2L GROUPs instead of FUNCTIONs).
+
+USE_CONSTANTS = False  # Should we use "constants" / "scalars" in the XDF? They kind of aren't good at all...
+
+INDENT = "  "
+
+# Size of the bin REGION in the XDF header, every table and axis is checked to fit in it
+REGION_SIZE = 0x400000
+DSG_REGION_SIZE = 0x180000
+
+# Fragments are built with placeholder category indices (see CategorySlots), far above any real index
+CATEGORY_SLOT_BASE = 1000000000
+
+# XDF Serialization methods
+
+
+def xdf_root_with_configuration(title, base_offset, region_size):
+    root = Element("XDFFORMAT")
+    root.set("version", "1.60")
+
+    xdfheader = SubElement(root, "XDFHEADER")
+    flags = SubElement(xdfheader, "flags")
+    flags.text = "0x1"
+    deftitle = SubElement(xdfheader, "deftitle")
+    deftitle.text = title
+    description = SubElement(xdfheader, "description")
+    description.text = "Auto-generated by A2L2XDF"
+    baseoffset = SubElement(xdfheader, "BASEOFFSET")
+    baseoffset.set("offset", base_offset)
+    baseoffset.set("subtract", "0")
+    defaults = SubElement(xdfheader, "DEFAULTS")
+    defaults.set("datasizeinbits", "8")
+    defaults.set("sigdigits", "4")
+    defaults.set("outputtype", "1")
+    defaults.set("signed", "0")
+    defaults.set("lsbfirst", "1")
+    defaults.set("float", "0")
+    region = SubElement(xdfheader, "REGION")
+    region.set("type", "0xFFFFFFFF")
+    region.set("startaddress", "0x0")
+    region.set("size", region_size)
+    region.set("regionflags", "0x0")
+    region.set("name", "Binary")
+    region.set("desc", "BIN for the XDF")
+    return [root, xdfheader]
+
+
+def xdf_embeddeddata(element: Element, id, axis_def, z_typeflags):
+    embeddeddata = SubElement(element, "EMBEDDEDDATA")
+    mmedtypeflags = 0x02 if id != "z" else z_typeflags
+    if axis_def["dataSize"] == "FLOAT32_IEEE":
+        mmedtypeflags += 0x10000
+
+    embeddeddata.set("mmedtypeflags", hex(mmedtypeflags))
+    embeddeddata.set("mmedaddress", str(axis_def["address"]))
+    embeddeddata.set("mmedelementsizebits", str(data_sizes[axis_def["dataSize"]] * 8))
+    embeddeddata.set(
+        "mmedcolcount", str(axis_def["length"]) if "length" in axis_def else "1"
+    )
+    if id == "z":
+        embeddeddata.set(
+            "mmedrowcount", str(axis_def["rows"]) if "rows" in axis_def else "1"
+        )
+    embeddeddata.set("mmedmajorstridebits", str(data_sizes[axis_def["dataSize"]] * 8))
+    embeddeddata.set("mmedminorstridebits", "0")
+    return embeddeddata
+
+
+def fake_xdf_axis_with_size(table: Element, id, size):
+    axis = SubElement(table, "XDFAXIS")
+    axis.set("uniqueid", "0x0")
+    axis.set("id", id)
+    indexcount = SubElement(axis, "indexcount")
+    indexcount.text = str(size)
+    outputtype = SubElement(axis, "outputtype")
+    outputtype.text = "4"
+    dalink = SubElement(axis, "DALINK")
+    dalink.set("index", "0")
+    math = SubElement(axis, "MATH")
+    math.set("equation", "X")
+    var = SubElement(math, "VAR")
+    var.set("id", "X")
+    for label_index in range(size):
+        label = SubElement(axis, "LABEL")
+        label.set("index", str(label_index))
+        label.set("value", "-")
+    return axis
+
+
+def xdf_axis_with_table(table: Element, id, axis_def, z_typeflags):
+    axis = SubElement(table, "XDFAXIS")
+    axis.set("uniqueid", "0x0")
+    axis.set("id", id)
+
+    xdf_embeddeddata(axis, id, axis_def, z_typeflags)
+
+    indexcount = SubElement(axis, "indexcount")
+    indexcount.text = str(axis_def["length"]) if "length" in axis_def else "1"
+    min = SubElement(axis, "min")
+    min.text = str(axis_def["min"])
+    max = SubElement(axis, "max")
+    max.text = str(axis_def["max"])
+    units = SubElement(axis, "units")
+    units.text = axis_def["units"]
+    embedinfo = SubElement(axis, "embedinfo")
+    embedinfo.set("type", "3")  # "Linked, Scale"
+    embedinfo.set("linkobjid", str(axis_def["address"]))
+    dalink = SubElement(axis, "DALINK")
+    dalink.set("index", "0")
+    math = SubElement(axis, "MATH")
+    math.set("equation", axis_def["math"])
+    var = SubElement(math, "VAR")
+    var.set("id", "X")
+    return axis
+
+
+def xdf_table_with_root(root: Element, table_def, categories):
+    table = SubElement(root, "XDFTABLE")
+    table.set("uniqueid", table_def["z"]["address"])
+    table.set("flags", "0x30")
+    title = SubElement(table, "title")
+    title.text = table_def["title"]
+    description = SubElement(table, "description")
+    description.text = table_def["description"]
+    table_categories = [table_def["category"]]
+    if "sub_category" in table_def:
+        table_categories.append(table_def["sub_category"])
+    if "subsub_category" in table_def:
+        table_categories.append(table_def["subsub_category"])
+    xdf_add_table_categories(table, table_categories, categories)
+    return table
+
+
+def xdf_add_table_categories(table, table_categories, categories):
+    index = 0
+    for category in table_categories:
+        categorymem = SubElement(table, "CATEGORYMEM")
+        categorymem.set("index", str(index))
+        categorymem.set("category", str(categories.index(category) + 1))
+        index += 1
+
+
+def xdf_constant_with_root(root: Element, table_def, categories, z_typeflags):
+    table = SubElement(root, "XDFCONSTANT")
+    table.set("uniqueid", table_def["z"]["address"])
+    title = SubElement(table, "title")
+    title.text = table_def["title"]
+    description = SubElement(table, "description")
+    description.text = table_def["description"]
+    table_categories = [table_def["category"]]
+    if "sub_category" in table_def:
+        table_categories.append(table_def["sub_category"])
+    if "subsub_category" in table_def:
+        table_categories.append(table_def["subsub_category"])
+    xdf_add_table_categories(table, table_categories, categories)
+
+    xdf_embeddeddata(table, "z", table_def["z"], z_typeflags)
+
+    math = SubElement(table, "MATH")
+    math.set("equation", table_def["z"]["math"])
+    var = SubElement(math, "VAR")
+    var.set("id", "X")
+
+    return table
+
+
+def xdf_table_from_axis(root: Element, table_def, axis_name, categories, z_typeflags):
+    table = SubElement(root, "XDFTABLE")
+    table.set("uniqueid", table_def[axis_name]["address"])
+    table.set("flags", "0x30")
+    title = SubElement(table, "title")
+    title.text = (
+        f'{table_def["title"]} : {axis_name} axis : {table_def[axis_name]["name"]}'
+    )
+    description = SubElement(table, "description")
+    description.text = table_def[axis_name]["name"]
+
+    table_categories = ["Axis"]
+
+    xdf_add_table_categories(table, table_categories, categories)
+    fake_xdf_axis_with_size(table, "x", table_def[axis_name]["length"])
+    fake_xdf_axis_with_size(table, "y", 1)
+    xdf_axis_with_table(table, "z", table_def[axis_name], z_typeflags)
+    return table
+
+
+def xdf_category(xdfheader: Element, category_name, category_index):
+    category = SubElement(xdfheader, "CATEGORY")
+    category.set("index", hex(category_index))
+    category.set("name", category_name)
+    return category
+
+
+class CategorySlots:
+    """
+    Stands in for the CategoryRegistry while a table is built into a reusable fragment: each
+    category gets a placeholder index that fill_category_slots() replaces with its real index
+    when the fragment is written, so a cached fragment stays valid when categories added by
+    other CSV rows shift the indices.
+    """
+
+    def __init__(self):
+        self.names = []
+
+    def index(self, name):
+        if name not in self.names:
+            self.names.append(name)
+        return CATEGORY_SLOT_BASE + self.names.index(name)
+
+
+def fill_category_slots(template, names, categories):
+    for slot, name in enumerate(names):
+        template = template.replace(
+            f'category="{CATEGORY_SLOT_BASE + slot + 1}"'.encode("us-ascii"),
+            f'category="{categories.index(name) + 1}"'.encode("us-ascii"),
+        )
+    return template
+
+
+# Resolved table to "normal" conversion methods
+
+
+def coefficients_to_equation(coefficients):
+    a, b, c, d, e, f = (str(coefficient) for coefficient in coefficients)
+    if a == "0.0" and d == "0.0":  # Polynomial is of order 1, ie linear
+        return f"(({f} * X) - {c} ) / ({b} - ({e} * X))"
+    else:
+        return "Cannot handle polynomial ratfunc because we do not know how to invert!"
+
+
+class XdfEmitter:
+    """
+    Writes one XDF, a table at a time. Call open() with the A2L's memory segments before
+    the first build_table() and close() once every table is built.
+    """
+
+    def __init__(self, filename, title, offset, dsg=False):
+        self.filename = filename
+        self.title = title
+        self.offset = offset
+        self.dsg = dsg
+        self.membership = "Group" if dsg else "Function"
+        self.z_typeflags = 0x02 if dsg else 0x06
+        self.categories = CategoryRegistry()
+        self.axis_index = AxisIndex()
+        self.address_ranges = AddressRanges()
+        self.base_offset = None
+        self.region_size = None
+        # Added to XDF addresses to get bin offsets (the XDF's BASEOFFSET)
+        self.bin_offset = None
+        self.root = None
+        self.xdfheader = None
+        self.xml_writer = None
+        self.fragments = None
+
+    def open(self, segments):
+        if self.dsg:
+            self.base_offset = 0x80000000 - int(self.offset, base=16)
+            self.region_size = DSG_REGION_SIZE
+            self.bin_offset = 0
+            base_offset = "0"
+        else:
+            self.base_offset = segments["_ROM"]
+            self.region_size = REGION_SIZE
+            self.bin_offset = int(self.offset, base=16)
+            base_offset = "0x" + self.offset
+        self.root, self.xdfheader = xdf_root_with_configuration(self.title, base_offset, hex(self.region_size))
+        self.categories.add("Axis")
+        self.xml_writer = StreamingXmlWriter(self.filename, [self.root], INDENT, header=self.xdfheader)
+        self.fragments = FragmentCache.load(self.filename)
+
+    def close(self):
+        # The header is written in front of the tables on close, so it can list every category
+        for category, index in self.categories.items():
+            xdf_category(self.xdfheader, category, index)
+        self.xml_writer.close()
+        self.fragments.save()
+
+        print(f"Tables reused from the previous run: {self.fragments.hits} of {len(self.fragments.current)}")
+        print(f"Axis tables: {len(self.axis_index)}")
+        for address, length, data_size, name, count in self.axis_index.shared():
+            print(f"Shared axis: {name} @ {hex(address)} ({length} x {data_size}) used by {count} maps")
+        self.check_address_ranges()
+
+    def abort(self):
+        # The previous fragments are kept, a partial run must not replace them
+        if self.xml_writer is not None:
+            self.xml_writer.abort()
+
+    def check_address_ranges(self):
+        outside = self.address_ranges.outside(self.region_size)
+        overlaps = self.address_ranges.overlaps()
+        for start, end, name in outside:
+            print(f"Outside the {hex(self.region_size)} byte bin: {name} @ {hex(start)}-{hex(end)}")
+        for (start1, end1, name1), (start2, end2, name2) in overlaps:
+            print(f"Overlapping: {name1} @ {hex(start1)}-{hex(end1)} and {name2} @ {hex(start2)}-{hex(end2)}")
+        print(f"Address ranges checked: {len(self.address_ranges)}, {len(outside)} outside the bin, {len(overlaps)} overlapping")
+
+    def adjust_address(self, address):
+        return address - self.base_offset
+
+    def add_address_ranges(self, c_data: TableDef, table_def, new_axes):
+        # Ranges are bin offsets, the whole map even where the XDF only links one cell (FIX_AXIS)
+        z_start = int(table_def["z"]["address"], 16) + self.bin_offset
+        self.address_ranges.add(z_start, calc_map_size(c_data), c_data.name)
+        for axis_name in new_axes:
+            axis_def = table_def[axis_name]
+            axis_start = int(axis_def["address"], 16) + self.bin_offset
+            self.address_ranges.add(axis_start, axis_def["length"] * data_sizes[axis_def["dataSize"]], axis_def["name"])
+
+    def axis_first_use(self, axis_def):
+        # Each shared axis gets a single axis table, however many maps reference it
+        return self.axis_index.add(
+            int(axis_def["address"], 16), axis_def["length"], axis_def["dataSize"], axis_def["name"]
+        )
+
+    def axis_to_dict(self, axis: AxisDef):
+        # The first value of STD_AXIS (and, outside DSG XDFs, COM_AXIS) data is the point count
+        axis_value = {
+            "name": axis.name,
+            "units": axis.units,
+            "min": axis.lower_limit,
+            "max": axis.upper_limit,
+            "address": hex(self.adjust_address(axis_points_address(axis, self.dsg))),
+            "length": axis.length,
+            "dataSize": axis.data_size,
+        }
+        if axis.coeffs is not None:
+            axis_value["math"] = coefficients_to_equation(axis.coeffs)
+        else:
+            axis_value["math"] = "X"
+        return axis_value
+
+    def spec(self):
+        """Class and arguments to create an emitter that renders like this one, e.g. in a worker process."""
+        return XdfEmitter, (self.filename, self.title, self.offset, self.dsg)
+
+    def build_table(self, c_data: TableDef, category, sub_category, subsub_category, custom_name):
+        key, fragment, render_args = self.prepare(c_data, category, sub_category, subsub_category, custom_name)
+        if fragment is None:
+            fragment = self.render(*render_args)
+        self.write(key, fragment)
+
+    def prepare(self, c_data: TableDef, category, sub_category, subsub_category, custom_name):
+        """
+        Everything about the next table that depends on the tables before it: registers its
+        categories, shared axes and address ranges. Returns the fragment key, the fragment from the previous
+        run (or None) and the arguments for render().
+        """
+        table_def = self.table_def(c_data, category, sub_category, subsub_category, custom_name)
+
+        new_axes = []
+        if "constant" not in table_def:
+            new_axes = [
+                axis_name
+                for axis_name in ("x", "y")
+                if axis_name in table_def and self.axis_first_use(table_def[axis_name])
+            ]
+        self.add_address_ranges(c_data, table_def, new_axes)
+
+        # Everything the serialized table depends on, including which axis tables it emits
+        key = fragment_key(self.dsg, table_def, new_axes)
+        return key, self.fragments.get(key), (table_def, new_axes)
+
+    def render(self, table_def, new_axes):
+        """Build and serialize a prepared table. Only depends on the XDF variant, not on other tables."""
+        root = Element("XDFFORMAT")
+        slots = CategorySlots()
+        self.table_elements(root, table_def, new_axes, slots)
+        return self.serialize(root), tuple(slots.names)
+
+    def serialize(self, root):
+        return serialize_elements(root, INDENT, 1)
+
+    def write(self, key, fragment):
+        template, names = fragment
+        self.xml_writer.write_fragment(fill_category_slots(template, names, self.categories))
+        self.fragments.add(key, fragment)
+
+    def table_def(self, c_data: TableDef, category, sub_category, subsub_category, custom_name):
+        axes = c_data.axes
+
+        self.categories.add(category)
+
+        table_def = {
+            "title": c_data.long_identifier,
+            "description": c_data.name if self.dsg else c_data.display_identifier,
+            "category": category,
+            "z": {
+                "min": c_data.lower_limit,
+                "max": c_data.upper_limit,
+                "address": hex(self.adjust_address(c_data.address)),
+                "dataSize": c_data.data_size,
+                "units": c_data.units,
+            },
+        }
+
+        if custom_name is not None and len(custom_name) > 0:
+            table_def["description"] += f'\nOriginal Name: {table_def["title"]}'
+            table_def["title"] = custom_name
+
+        if sub_category is not None and len(sub_category) > 0:
+            self.categories.add(sub_category)
+            table_def["sub_category"] = sub_category
+
+        if subsub_category is not None and len(subsub_category) > 0:
+            self.categories.add(subsub_category)
+            table_def["subsub_category"] = subsub_category
+
+        if c_data.coeffs is None or table_def["z"]["dataSize"] == "FLOAT32_IEEE":
+            table_def["z"]["math"] = "X"
+        else:
+            table_def["z"]["math"] = coefficients_to_equation(c_data.coeffs)
+
+        if len(c_data.dimensions) == 0 and USE_CONSTANTS is True:
+            table_def["constant"] = True
+
+        # FIX_AXIS has no data in the bin to link an XDF axis to
+        if len(axes) > 0 and axes[0] is not None and axes[0].kind != "FIX_AXIS":
+            table_def["x"] = self.axis_to_dict(axes[0])
+            table_def["z"]["length"] = table_def["x"]["length"]
+            table_def["description"] += f'\nX: {table_def["x"]["name"]}'
+
+        if len(axes) > 1 and axes[1] is not None and axes[1].kind != "FIX_AXIS":
+            table_def["y"] = self.axis_to_dict(axes[1])
+            table_def["z"]["rows"] = table_def["y"]["length"]
+            table_def["description"] += f'\nY: {table_def["y"]["name"]}'
+
+        return table_def
+
+    def table_elements(self, root, table_def, new_axes, categories):
+        if "constant" in table_def:
+            xdf_constant_with_root(root, table_def, categories, self.z_typeflags)
+        else:
+            table = xdf_table_with_root(root, table_def, categories)
+
+            if "x" in table_def:
+                xdf_axis_with_table(table, "x", table_def["x"], self.z_typeflags)
+                if "x" in new_axes:
+                    xdf_table_from_axis(root, table_def, "x", categories, self.z_typeflags)
+            else:
+                fake_xdf_axis_with_size(table, "x", 1)
+
+            if "y" in table_def:
+                xdf_axis_with_table(table, "y", table_def["y"], self.z_typeflags)
+                if "y" in new_axes:
+                    xdf_table_from_axis(root, table_def, "y", categories, self.z_typeflags)
+            else:
+                fake_xdf_axis_with_size(table, "y", 1)
+
+            xdf_axis_with_table(table, "z", table_def["z"], self.z_typeflags)
@@ -0,0 +1,301 @@
+import decimal
+
+from xml.etree.ElementTree import Element, SubElement
+
+from fragments import FragmentCache, fragment_key
+from tabledefs import AxisDef, TableDef, axis_points_address
+from xmlstream import StreamingXmlWriter, serialize_elements
+
+# ECU definition XML output, shared by a2l2xml.py and a2lconvert.py
+
+USE_CONSTANTS = False  # Should we use "constants" / "scalars" in the XML? They kind of aren't good at all...
+
+storage_types = {
+    "UBYTE": 'uint8',
+    "SBYTE": 'int8',
+    "UWORD": 'uint16',
+    "SWORD": 'int16',
+    "ULONG": 'uint32',
+    "SLONG": 'int32',
+    "FLOAT32_IEEE": 'float',
+}
+
+INDENT = "\t"
+
+# ALL mode walks A2L FUNCTIONs for Simos18 and GROUPs for DQ250
+memberships = {"Simos18": "Function", "DQ250": "Group"}
+
+# create a new context for this task
+ctx = decimal.Context()
+ctx.prec = 20
+
+# XML Serialization methods
+
+
+def xml_root_with_configuration(title, ecu):
+    root = Element("ecus")
+
+    xmlheader = SubElement(root, "ecu_struct")
+    xmlheader.set('id',str(title).rstrip(".a2l").lstrip(".\\"))
+    xmlheader.set('type',str(title).rstrip(".a2l").lstrip(".\\"))
+    xmlheader.set('include',"")
+    if ecu == "Simos18":
+        xmlheader.set('desc_size',"#400000")
+    if ecu == "DQ250":
+        xmlheader.set('desc_size',"#140000")
+    xmlheader.set('reverse_bytes',"False")
+    xmlheader.set('ecu_type',"vag")
+    xmlheader.set('flash_template',"")
+    xmlheader.set('checksum',"")
+
+    return [root, xmlheader]
+
+
+def xml_table_with_root(root: Element, table_def, ecu):
+    axis_count = 1
+    if "x" in table_def:
+        axis_count += 1
+    if "y" in table_def:
+        axis_count += 1
+
+    table = SubElement(root, "map")
+    table.set('name',table_def["title"])
+    table.set("type",str(axis_count))
+    table.set("help",table_def["description"])
+    table.set("class","|".join(table_def["category"]))
+
+    data = SubElement(table,"data")
+    data.set("offset","#"+table_def['z']['address'].lstrip("0x"))
+    data.set("storagetype",str(storage_types[table_def['z']["dataSize"]]))
+    data.set("func_2val",table_def['z']['math'])
+    data.set("func_val2",table_def['z']['math2'])
+    data.set("format","%0.2f")
+    data.set("metric",table_def['z']['units'])
+    data.set("min",str(table_def['z']['min']))
+    data.set("max",str(table_def['z']['max']))
+    if ecu == "Simos18":
+        data.set("order", "rc")
+
+    if "x" in table_def:
+        rows = SubElement(table,"cols")
+        rows.set("count",str(table_def['x']['length']))
+        rows.set("offset","#"+table_def['x']['address'].lstrip("0x"))
+        rows.set("storagetype",str(storage_types[table_def['x']["dataSize"]]))
+        rows.set("func_2val",table_def['x']['math'])
+        rows.set("func_val2",table_def['x']['math2'])
+        rows.set("format","%0.2f")
+        rows.set("metric",table_def['x']['units'])
+        if table_def['x']['conv_typ'] == "TAB_VERB":
+            for values in table_def['x']['values']:
+                valueElement = SubElement(rows, "value")
+                valueElement.text = values
+
+
+    if "y" in table_def:
+        cols = SubElement(table,"rows")
+        cols.set("count",str(table_def['y']['length']))
+        cols.set("offset","#"+table_def['y']['address'].lstrip("0x"))
+        cols.set("storagetype",str(storage_types[table_def['y']["dataSize"]]))
+        cols.set("func_2val",table_def['y']['math'])
+        cols.set("func_val2",table_def['y']['math2'])
+        cols.set("format","%0.2f")
+        cols.set("metric",table_def['y']['units'])
+        if table_def['y']['conv_typ'] == "TAB_VERB":
+            for values in table_def['y']['values']:
+                valueElement = SubElement(cols, "value")
+                valueElement.text = values
+
+    return table
+
+
+# Resolved table to "normal" conversion methods
+
+
+def coefficients_to_equation(coefficients, inverse):
+    a, b, c, d, e, f = (float_to_str(coefficient) for coefficient in coefficients)
+
+    s1 = '+'
+    s2 = '-'
+    if c[0] == '-':
+        c = c[1:]
+        s1 = '-'
+        s2 = '+'
+
+    operation = ""
+    if inverse is True:
+        operation = f"({b} * ([x] / {f})) {s1} {c}"
+    else:
+        operation = f"(({f} * [x]) {s2} {c}) / {b}"
+
+    if a == "0.0" and d == "0.0" and e=="0.0" and f!="0.0":  # Polynomial is of order 1, ie linear original: f"(({f} * [x]) - {c} ) / ({b} - ({e} * [x]))"
+        return operation
+    else:
+        return "Cannot handle polynomial ratfunc because we do not know how to invert!"
+
+
+def float_to_str(f):
+    """
+    Convert the given float to a string,
+    without resorting to scientific notation
+    """
+    d1 = ctx.create_decimal(repr(f))
+    return format(d1, 'f')
+
+
+class XmlEmitter:
+    """
+    Writes one ECU definition XML, a table at a time. Call open() with the A2L's memory
+    segments before the first build_table() and close() once every table is built.
+    """
+
+    def __init__(self, filename, title, ecu, offset):
+        self.filename = filename
+        self.title = title
+        self.ecu = ecu
+        self.offset = offset
+        self.membership = memberships.get(ecu)
+        self.base_offset = None
+        self.root = None
+        self.xmlheader = None
+        self.xml_writer = None
+        self.fragments = None
+
+    def open(self, segments):
+        if self.ecu == "DQ250":
+            self.base_offset = 0x80000000
+        if self.ecu == "Simos18":
+            self.base_offset = segments["_ROM"]
+        self.root, self.xmlheader = xml_root_with_configuration(self.title, self.ecu)
+        self.xml_writer = StreamingXmlWriter(self.filename, [self.root, self.xmlheader], INDENT)
+        self.fragments = FragmentCache.load(self.filename)
+
+    def close(self):
+        self.xml_writer.close()
+        self.fragments.save()
+        print(f"Tables reused from the previous run: {self.fragments.hits} of {len(self.fragments.current)}")
+
+    def abort(self):
+        # The previous fragments are kept, a partial run must not replace them
+        if self.xml_writer is not None:
+            self.xml_writer.abort()
+
+    def adjust_address(self, address):
+        return address - self.base_offset + int(self.offset, base=16)
+
+    def axis_to_dict(self, axis: AxisDef):
+        # STD_AXIS (and Simos18 COM_AXIS) points are offset by 1 value, the first value is another length
+        axis_value = {
+            "name": axis.name,
+            "units": axis.units,
+            "min": axis.lower_limit,
+            "max": axis.upper_limit,
+            "address": (
+                hex(self.adjust_address(axis_points_address(axis, dsg=self.ecu != "Simos18")))
+                if axis.address is not None
+                else hex(0)
+            ),
+            "length": axis.length,
+            "dataSize": axis.data_size,
+            "conv_typ": axis.conversion_type,
+        }
+
+        if axis.conversion_type == "TAB_VERB":
+            axis_value["values"] = axis.values
+
+        if axis.coeffs is not None:
+            axis_value["math"] = coefficients_to_equation(axis.coeffs, False)
+        else:
+            axis_value["math"] = "X"
+
+        if axis.coeffs is not None:
+            axis_value["math2"] = coefficients_to_equation(axis.coeffs, True)
+        else:
+            axis_value["math2"] = "X"
+
+        return axis_value
+
+    def spec(self):
+        """Class and arguments to create an emitter that renders like this one, e.g. in a worker process."""
+        return XmlEmitter, (self.filename, self.title, self.ecu, self.offset)
+
+    def build_table(self, c_data: TableDef, category, category2, category3, custom_name):
+        key, fragment, render_args = self.prepare(c_data, category, category2, category3, custom_name)
+        if fragment is None:
+            fragment = self.render(*render_args)
+        self.write(key, fragment)
+
+    def prepare(self, c_data: TableDef, category, category2, category3, custom_name):
+        """Returns the fragment key, the fragment from the previous run (or None) and the arguments for render()."""
+        table_def = self.table_def(c_data, category, category2, category3, custom_name)
+        key = fragment_key(self.ecu, table_def)
+        return key, self.fragments.get(key), (table_def,)
+
+    def render(self, table_def):
+        """Build and serialize a prepared table. Only depends on the ECU, not on other tables."""
+        root = Element("ecu_struct")
+        xml_table_with_root(root, table_def, self.ecu)
+        return self.serialize(root)
+
+    def serialize(self, root):
+        return serialize_elements(root, INDENT, 2)
+
+    def write(self, key, fragment):
+        self.xml_writer.write_fragment(fragment)
+        self.fragments.add(key, fragment)
+
+    def table_def(self, c_data: TableDef, category, category2, category3, custom_name):
+        axes = c_data.axes
+
+        table_def = {
+            "title": c_data.long_identifier,
+            "category": [category],
+            "z": {
+                "min": c_data.lower_limit,
+                "max": c_data.upper_limit,
+                "address": hex(self.adjust_address(c_data.address)),
+                "dataSize": c_data.data_size,
+                "units": c_data.units,
+            },
+        }
+
+        if self.ecu == "DQ250":
+            table_def["description"] = c_data.name
+        else:
+            table_def["description"] = c_data.display_identifier
+
+        if custom_name is not None and len(custom_name) > 0:
+            # table_def["description"] += f'|Original Name: {table_def["title"]}'
+            table_def["title"] = custom_name
+
+        id_name = table_def["description"]
+        table_def["title"] += f" ({id_name})"
+
+        if category2 is not None and len(category2) > 0:
+            table_def["category"].append(category2)
+
+        if category3 is not None and len(category3) > 0:
+            table_def["category"].append(category3)
+
+        if c_data.coeffs is not None:
+            table_def["z"]["math"] = coefficients_to_equation(c_data.coeffs, False)
+            table_def["z"]["math2"] = coefficients_to_equation(c_data.coeffs, True)
+        else:
+            table_def["z"]["math"] = "X"
+            table_def["z"]["math2"] = "X"
+
+        if len(c_data.dimensions) == 0 and USE_CONSTANTS is True:
+            table_def["constant"] = True
+
+        # Descriptions list COM_AXIS, then FIX_AXIS, then STD_AXIS axes
+        for kind, separator in (("COM_AXIS", "|"), ("FIX_AXIS", "\n"), ("STD_AXIS", "\n")):
+            if len(axes) > 0 and axes[0] is not None and axes[0].kind == kind:
+                table_def["x"] = self.axis_to_dict(axes[0])
+                table_def["z"]["length"] = table_def["x"]["length"]
+                table_def["description"] += f'{separator}X: {table_def["x"]["name"]}'
+
+            if len(axes) > 1 and axes[1] is not None and axes[1].kind == kind:
+                table_def["y"] = self.axis_to_dict(axes[1])
+                table_def["z"]["rows"] = table_def["y"]["length"]
+                table_def["description"] += f'{separator}Y: {table_def["y"]["name"]}'
+
+        return table_def
@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+
+import xml.etree.ElementTree as ET
+
+from a2lprofile import stage
+
+# Incremental writer for the XDF / XML outputs.
+#
+# The converters used to build the whole document, ET.indent it and write it out at the end.
+# StreamingXmlWriter writes each finished table to disk as soon as it is built instead,
+# indenting it on the fly, and produces exactly the same bytes as
+# ET.indent(tree, space) followed by tree.write(filename).
+
+
+def start_tag(element):
+    marker = "\x01"
+    element = ET.Element(element.tag, element.attrib)
+    element.text = marker
+    return ET.tostring(element, encoding="us-ascii").split(marker.encode("us-ascii"))[0]
+
+
+def end_tag(element):
+    return f"</{element.tag}>".encode("us-ascii")
+
+
+def element_bytes(element, space, level):
+    """An element as it appears in the indented document, at the given depth."""
+    element.tail = None
+    ET.indent(element, space=space, level=level)
+    return ("\n" + space * level).encode("us-ascii") + ET.tostring(element, encoding="us-ascii")
+
+
+def serialize_elements(parent, space, level):
+    """Serialize the children of a scratch parent, as if they were tables flushed at the given depth."""
+    with stage("serialize"):
+        return b"".join(element_bytes(element, space, level) for element in parent)
+
+
+class StreamingXmlWriter:
+    """
+    parents is the chain of wrapper elements from the document root down to the element
+    that receives the tables, e.g. [XDFFORMAT] or [ecus, ecu_struct].
+    Tables appended to the last parent are written out by flush(), which returns the bytes
+    it wrote so they can be replayed with write_fragment() by a later, incremental run
+    (serialize() returns them without writing, for callers that patch fragments first).
+
+    If a header element is given it is detached from its parent and written in front of
+    the tables by close(), so it can keep growing (e.g. with categories) while tables are
+    streamed. In that case tables are spooled to a temporary file until close().
+    """
+
+    def __init__(self, filename, parents, space, header=None):
+        self.filename = filename
+        self.parents = parents
+        self.container = parents[-1]
+        self.space = space
+        self.level = len(parents)
+        self.header = header
+        self.count = 0
+        if header is not None:
+            self.container.remove(header)
+            self.stream = tempfile.TemporaryFile()
+        else:
+            self.stream = open(filename, "wb")
+            self.stream.write(self.prefix())
+
+    def prefix(self):
+        prefix = b""
+        for level, parent in enumerate(self.parents):
+            if level > 0:
+                prefix += ("\n" + self.space * level).encode("us-ascii")
+            prefix += start_tag(parent)
+        return prefix
+
+    def suffix(self):
+        suffix = b""
+        for level in reversed(range(len(self.parents))):
+            suffix += ("\n" + self.space * level).encode("us-ascii") + end_tag(self.parents[level])
+        return suffix
+
+    def write_element(self, stream, element):
+        stream.write(element_bytes(element, self.space, self.level))
+
+    def serialize(self):
+        """Serialize and remove the pending tables, without writing them."""
+        fragment = serialize_elements(self.container, self.space, self.level)
+        del self.container[:]
+        return fragment
+
+    def flush(self):
+        fragment = self.serialize()
+        self.write_fragment(fragment)
+        return fragment
+
+    def write_fragment(self, fragment):
+        """Write tables serialized by serialize() or flush(), now or in an earlier run."""
+        with stage("write"):
+            self.stream.write(fragment)
+            if len(fragment) > 0:
+                self.count += 1
+
+    def close(self):
+        self.flush()
+        with stage("serialize"):
+            self.write_out()
+
+    def abort(self):
+        """Close the output after a failed run, removing what was written of it."""
+        self.stream.close()
+        if self.header is None and os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def write_out(self):
+        if self.header is not None:
+            with open(self.filename, "wb") as output:
+                output.write(self.prefix())
+                self.write_element(output, self.header)
+                self.stream.seek(0)
+                shutil.copyfileobj(self.stream, output)
+                output.write(self.suffix())
+        elif self.count == 0:
+            # Match ElementTree's short form for an empty document
+            self.stream.seek(0)
+            self.stream.truncate()
+            ET.indent(self.parents[0], space=self.space, level=0)
+            self.stream.write(ET.tostring(self.parents[0], encoding="us-ascii"))
+        else:
+            self.stream.write(self.suffix())
+        self.stream.close()